@@ -0,0 +1,214 @@
+/**
+ * @file
+ * Client for the compathd.py COM path server.
+ *
+ * Takes the same arguments as compath.py and prints the same output,
+ * but asks a running compathd.py server over a Unix domain socket
+ * instead of starting a Python interpreter. If the server is not
+ * running, or the arguments are ones the client does not handle
+ * (e.g. --batch or --help), compath.py is run in its place.
+ *
+ * Usage: compathc [-o] [-e envir] [-f] [-v] relpath
+ *
+ * The socket is $COMPATHD_SOCKET, or /tmp/compathd.<uid>. See
+ * ush/compathd.py for the protocol. The server is used only if the
+ * socket and the process listening on it belong to the caller, and
+ * compath.py is run instead when the server does not answer within
+ * $COMPATHD_TIMEOUT seconds (default 10).
+ */
+#define _GNU_SOURCE
+#include <stdio.h>
+#include <stdlib.h>
+#include <errno.h>
+#include <string.h>
+#include <unistd.h>
+#include <sys/socket.h>
+#include <sys/stat.h>
+#include <sys/time.h>
+#include <sys/un.h>
+
+/** Program run when the server cannot be used. */
+#define FALLBACK "compath.py"
+
+/** Seconds to wait for the server when $COMPATHD_TIMEOUT is not set. */
+#define DEFAULT_TIMEOUT 10
+
+/**
+ * Replace this process with compath.py, passing it the original
+ * arguments.
+ *
+ * @param argv Arguments given to compathc.
+ */
+static void fallback(char **argv)
+{
+     argv[0] = FALLBACK;
+     execvp(FALLBACK, argv);
+     fprintf(stderr, "Could not run %s, errno=%d\n", FALLBACK, errno);
+     exit(1);
+}
+
+/**
+ * Append an environment variable to the request: empty if it is
+ * unset, otherwise "=" followed by its value.
+ *
+ * @param request Request being built.
+ * @param size Size of the request buffer.
+ * @param name Name of the environment variable.
+ * @param last Whether this is the last field of the request.
+ *
+ * @return 0 on success, -1 if the value does not fit or contains a
+ * tab or newline.
+ */
+static int add_env(char *request, size_t size, const char *name, int last)
+{
+     const char *value = getenv(name);
+     size_t len = strlen(request);
+     int n;
+
+     if (value && strpbrk(value, "\t\n"))
+          return -1;
+     n = snprintf(request + len, size - len, "%s%s%c", value ? "=" : "",
+                  value ? value : "", last ? '\n' : '\t');
+     return (n < 0 || (size_t)n >= size - len) ? -1 : 0;
+}
+
+/**
+ * Check that a socket, and the server connected to it, belong to the
+ * caller, so that another user cannot answer in the server's place.
+ *
+ * @param fd Connected socket.
+ * @param socket_path Path of the socket.
+ *
+ * @return 0 if both belong to the caller, -1 otherwise.
+ */
+static int check_owner(int fd, const char *socket_path)
+{
+     struct stat st;
+
+     if (lstat(socket_path, &st) == -1 || !S_ISSOCK(st.st_mode) || st.st_uid != getuid())
+          return -1;
+#ifdef SO_PEERCRED
+     {
+          struct ucred cred;
+          socklen_t len = sizeof(cred);
+
+          if (getsockopt(fd, SOL_SOCKET, SO_PEERCRED, &cred, &len) == -1 || cred.uid != getuid())
+               return -1;
+     }
+#endif
+     return 0;
+}
+
+/**
+ * Limit how long sends and receives on a socket may block.
+ *
+ * @param fd Socket.
+ *
+ * @return 0 on success, -1 on failure.
+ */
+static int set_timeout(int fd)
+{
+     const char *value = getenv("COMPATHD_TIMEOUT");
+     double seconds = value && *value ? atof(value) : DEFAULT_TIMEOUT;
+     struct timeval timeout;
+
+     if (seconds <= 0)
+          seconds = DEFAULT_TIMEOUT;
+     timeout.tv_sec = (time_t)seconds;
+     timeout.tv_usec = (suseconds_t)((seconds - timeout.tv_sec) * 1e6);
+     if (setsockopt(fd, SOL_SOCKET, SO_RCVTIMEO, &timeout, sizeof(timeout)) == -1 ||
+         setsockopt(fd, SOL_SOCKET, SO_SNDTIMEO, &timeout, sizeof(timeout)) == -1)
+          return -1;
+     return 0;
+}
+
+int main(int argc, char **argv)
+{
+     char flags[4] = "";
+     const char *envir = "";
+     const char *relpath = NULL;
+     const char *socket_path;
+     char default_socket[64];
+     char request[65536];
+     char *line = NULL;
+     size_t line_size = 0;
+     struct sockaddr_un addr;
+     FILE *conn;
+     int fd, i, n, status = -1;
+
+     /* Parse the options handled by the client */
+     for (i = 1; i < argc; i++) {
+          if (!strcmp(argv[i], "-o") || !strcmp(argv[i], "--out")) {
+               if (!strchr(flags, 'o'))
+                    strcat(flags, "o");
+          } else if (!strcmp(argv[i], "-f") || !strcmp(argv[i], "--first")) {
+               if (!strchr(flags, 'f'))
+                    strcat(flags, "f");
+          } else if (!strcmp(argv[i], "-v") || !strcmp(argv[i], "--verbose")) {
+               if (!strchr(flags, 'v'))
+                    strcat(flags, "v");
+          } else if ((!strcmp(argv[i], "-e") || !strcmp(argv[i], "--envir")) && i + 1 < argc) {
+               envir = argv[++i];
+          } else if (argv[i][0] != '-' && !relpath) {
+               relpath = argv[i];
+          } else {
+               fallback(argv);
+          }
+     }
+     if (!relpath || strpbrk(relpath, "\t\n"))
+          fallback(argv);
+     /* Leave invalid environments to compath.py's own error message */
+     if (*envir && strcmp(envir, "prod") && strcmp(envir, "para") &&
+         strcmp(envir, "test") && strcmp(envir, "canned"))
+          fallback(argv);
+
+     /* Connect to the server */
+     socket_path = getenv("COMPATHD_SOCKET");
+     if (!socket_path || !*socket_path) {
+          snprintf(default_socket, sizeof(default_socket), "/tmp/compathd.%d", (int)getuid());
+          socket_path = default_socket;
+     }
+     if (strlen(socket_path) >= sizeof(addr.sun_path))
+          fallback(argv);
+     memset(&addr, 0, sizeof(addr));
+     addr.sun_family = AF_UNIX;
+     strcpy(addr.sun_path, socket_path);
+     fd = socket(AF_UNIX, SOCK_STREAM, 0);
+     if (fd == -1 || set_timeout(fd) || connect(fd, (struct sockaddr *)&addr, sizeof(addr)) == -1 ||
+         check_owner(fd, socket_path))
+          fallback(argv);
+
+     /* Send the request */
+     n = snprintf(request, sizeof(request), "%s\t%s\t%s\t", *flags ? flags : "-", envir, relpath);
+     if (n < 0 || (size_t)n >= sizeof(request) ||
+         add_env(request, sizeof(request), "COMPATH", 0) ||
+         add_env(request, sizeof(request), "COMROOT", 0) ||
+         add_env(request, sizeof(request), "envir", 1))
+          fallback(argv);
+     if (write(fd, request, strlen(request)) != (ssize_t)strlen(request))
+          fallback(argv);
+     shutdown(fd, SHUT_WR);
+
+     /* Print the reply */
+     conn = fdopen(fd, "r");
+     if (!conn)
+          fallback(argv);
+     while (status == -1 && getline(&line, &line_size, conn) != -1) {
+          if (line[0] == '2' && line[1] == '\t') {
+               fputs(line + 2, stderr);
+          } else if (line[0] == '0' && line[1] == '\t') {
+               fputs(line + 2, stdout);
+               status = 0;
+          } else if (line[0] == '1' && line[1] == '\t') {
+               fputs(line + 2, stderr);
+               status = 1;
+          }
+     }
+     fclose(conn);
+     free(line);
+
+     /* The server went away or timed out before answering */
+     if (status == -1)
+          fallback(argv);
+     return status;
+}
@@ -0,0 +1,153 @@
+/**
+ * @file
+ * Client for the postmsgd.py log collector.
+ *
+ * Formats a postmsg line, "MM/DD HH:MM:SSZ jobid-message", and sends it
+ * to a running postmsgd.py collector over a Unix datagram socket, so
+ * that the collector can append the lines of many writers to the log
+ * file together. If the collector is not running or cannot take the
+ * line, the line is appended to the log file directly, with a single
+ * write.
+ *
+ * Usage: postmsgc logfile message
+ *
+ * The socket is $POSTMSGD_SOCKET, or /tmp/postmsgd.<uid>. Each datagram
+ * is the absolute path of the log file, a NUL character, and the line.
+ * Lines are only sent to a socket that belongs to the caller, so that
+ * another user cannot collect them by binding the socket first, and
+ * datagrams longer than the collector reads are appended directly.
+ */
+#include <stdio.h>
+#include <stdlib.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <limits.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
+#include <sys/socket.h>
+#include <sys/stat.h>
+#include <sys/un.h>
+
+/** Longest datagram the collector reads (MAX_DATAGRAM in postmsgd.py). */
+#define MAX_DATAGRAM 65536
+
+/**
+ * Send a line to the collector without waiting for it, if the collector
+ * runs as the caller.
+ *
+ * @param logfile Absolute path of the log file.
+ * @param line Line to append, ending with a newline.
+ *
+ * @return 0 if the collector took the line, -1 otherwise.
+ */
+static int send_line(const char *logfile, const char *line)
+{
+     const char *socket_path = getenv("POSTMSGD_SOCKET");
+     char default_socket[64];
+     struct sockaddr_un addr;
+     struct stat st;
+     size_t len = strlen(logfile) + 1 + strlen(line);
+     char *datagram;
+     ssize_t sent;
+     int fd;
+
+     if (!socket_path || !*socket_path) {
+          snprintf(default_socket, sizeof(default_socket), "/tmp/postmsgd.%d", (int)getuid());
+          socket_path = default_socket;
+     }
+     if (strlen(socket_path) >= sizeof(addr.sun_path) || len > MAX_DATAGRAM)
+          return -1;
+     memset(&addr, 0, sizeof(addr));
+     addr.sun_family = AF_UNIX;
+     strcpy(addr.sun_path, socket_path);
+
+     datagram = malloc(len);
+     if (!datagram)
+          return -1;
+     strcpy(datagram, logfile);
+     strcpy(datagram + strlen(logfile) + 1, line);
+     fd = socket(AF_UNIX, SOCK_DGRAM, 0);
+     if (fd == -1) {
+          free(datagram);
+          return -1;
+     }
+     /* Check the owner of the socket connected to, which another user cannot replace in /tmp */
+     if (connect(fd, (struct sockaddr *)&addr, sizeof(addr)) == -1 ||
+         lstat(socket_path, &st) == -1 || !S_ISSOCK(st.st_mode) || st.st_uid != getuid()) {
+          close(fd);
+          free(datagram);
+          return -1;
+     }
+     /* Fails at once if no collector is listening or its queue is full */
+     sent = send(fd, datagram, len, MSG_DONTWAIT);
+     close(fd);
+     free(datagram);
+     return sent == (ssize_t)len ? 0 : -1;
+}
+
+/**
+ * Append a line to the log file with a single write.
+ *
+ * @param logfile Path of the log file.
+ * @param line Line to append, ending with a newline.
+ *
+ * @return 0 on success, -1 on failure.
+ */
+static int append_line(const char *logfile, const char *line)
+{
+     size_t len = strlen(line);
+     int fd = open(logfile, O_WRONLY | O_APPEND | O_CREAT, 0666);
+
+     if (fd == -1) {
+          fprintf(stderr, "postmsg: cannot open %s: %s\n", logfile, strerror(errno));
+          return -1;
+     }
+     if (write(fd, line, len) != (ssize_t)len) {
+          fprintf(stderr, "postmsg: cannot write to %s: %s\n", logfile, strerror(errno));
+          close(fd);
+          return -1;
+     }
+     return close(fd);
+}
+
+int main(int argc, char **argv)
+{
+     const char *jobid = getenv("jobid");
+     char datestr[32];
+     char cwd[PATH_MAX];
+     char *logfile, *line;
+     size_t len;
+     time_t now = time(NULL);
+     int status;
+
+     if (argc != 3) {
+          fprintf(stderr, "Usage: postmsgc logfile message\n");
+          return 16;
+     }
+     strftime(datestr, sizeof(datestr), "%m/%d %H:%M:%S", gmtime(&now));
+     len = strlen(datestr) + strlen(jobid ? jobid : "") + strlen(argv[2]) + 5;
+     line = malloc(len);
+     if (!line)
+          return 1;
+     snprintf(line, len, "%sZ %s-%s\n", datestr, jobid ? jobid : "", argv[2]);
+
+     /* The collector runs in its own directory, so send it an absolute path */
+     if (argv[1][0] == '/') {
+          logfile = strdup(argv[1]);
+     } else if (getcwd(cwd, sizeof(cwd))) {
+          logfile = malloc(strlen(cwd) + strlen(argv[1]) + 2);
+          if (logfile)
+               sprintf(logfile, "%s/%s", cwd, argv[1]);
+     } else {
+          logfile = NULL;
+     }
+
+     if (logfile && send_line(logfile, line) == 0)
+          status = 0;
+     else
+          status = append_line(argv[1], line) ? 1 : 0;
+     free(logfile);
+     free(line);
+     return status;
+}
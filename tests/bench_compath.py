@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+#
+# This is a benchmark for the NCEPLIBS-prod_util project. It times COM
+# path resolution by compath.py against synthetic compaths.list files
+# and COMPATH values in a fake /lfs tree, and writes the results to a
+# JSON file so that releases can be compared.
+#
+# Usage:   bench_compath.py [--root dir] [--output file] [--compare file] [--quick]
+#
+# Each case records the mean and 95th percentile latency per lookup in
+# microseconds, and the peak memory allocated by Python in kilobytes:
+#   list_<N>:        list-file lookups through the compaths.list index
+#   findpath_<N>:    the same lookups with the linear findpath scan
+#   index_<N>:       building and loading the index of an N-line list
+#   compath_<N>:     COMPATH lookups with N members, parsed every time
+#   probe:           searches of the COM directories, uncached and cached
+#   cold_start:      a new interpreter importing compath and resolving once
+# With --compare, a case that is more than --threshold times slower than
+# in the given results file makes the benchmark exit with status 1.
+
+import argparse, json, os, platform, random, resource, subprocess, sys, tempfile, time, tracemalloc
+from os import path
+
+ushdir = path.join(path.dirname(path.abspath(__file__)), '..', 'ush')
+sys.path.insert(0, ushdir)
+import compath
+
+ENVIR = 'prod'
+NETS = ['gfs', 'gefs', 'nam', 'hrrr', 'rap', 'rtofs', 'wave', 'aqm', 'href', 'hiresw']
+RUNS = ['gfs', 'gdas', 'enkf', 'atmos', 'wave', 'chem', 'conus', 'ak', 'hi', 'pr']
+
+def make_entries(count, seed=0):
+    """!Returns count distinct (NET, version, RUN, PDY) tuples, like the entries
+    of parm/compaths_prod.list but with version numbers and RUN directories.
+    """
+    rng = random.Random(seed)
+    entries = list()
+    seen = set()
+    while len(entries) < count:
+        net = rng.choice(NETS) + str(rng.randrange(count // 10 + 1))
+        version = 'v%d.%d' % (rng.randrange(1, 20), rng.randrange(10))
+        run = rng.choice(RUNS + [None, None])
+        pdy = '2023%02d%02d' % (rng.randrange(1, 13), rng.randrange(1, 29)) if run and rng.random() < 0.2 else None
+        entry = (net, version, run, pdy)
+        if entry not in seen:
+            seen.add(entry)
+            entries.append(entry)
+    return entries
+
+def entry_path(root, entry, fs='h1'):
+    net, version, run, pdy = entry
+    dirpath = '%s/%s/ops/%s/com/%s/%s' % (root, fs, ENVIR, net, version)
+    if run:
+        dirpath += '/' + run + ('.' + pdy if pdy else '')
+    return dirpath
+
+def entry_relpath(entry):
+    net, version, run, pdy = entry
+    # Look up a cycle below the entry, so that the fallback to shorter paths is exercised
+    return '%s/%s/%s.%s/00' % (net, version, run or 'gfs', pdy or '20230101')
+
+def write_list(root, entries):
+    config = '%s/h1/ops/%s/config' % (root, ENVIR)
+    os.makedirs(config, exist_ok=True)
+    filename = config + '/compaths.list'
+    with open(filename, 'w') as list_file:
+        list_file.write('# synthetic list of %d entries\n' % len(entries))
+        for i, entry in enumerate(entries):
+            list_file.write(entry_path(root, entry, 'h1' if i % 2 else 'h2') + '\n')
+    if path.exists(filename + compath.COMPATHS_INDEX_SUFFIX):
+        os.unlink(filename + compath.COMPATHS_INDEX_SUFFIX)
+    return filename
+
+def make_aliases(root):
+    return {'/comh1': root + '/h1/ops/<envir>/com', '/comh2': root + '/h2/ops/<envir>/com'}
+
+def make_resolver(root, compaths_list=None, **kwargs):
+    if compaths_list is None:
+        compaths_list = root + '/h1/ops/<envir>/config/compaths.list'
+    return compath.CompathResolver(aliases=make_aliases(root), compaths_list=compaths_list,
+                                   environ={'envir': ENVIR}, probe_cache='', **kwargs)
+
+def measure(func, args_list, repeat, warmup=True):
+    """!Calls func once with each member of args_list, repeat times, and returns
+    the latency statistics in microseconds and the peak memory in kilobytes.
+    Memory is traced in a separate pass, since tracing slows Python down.
+    """
+    if warmup:
+        func(*args_list[0])
+    times = list()
+    for i in range(repeat):
+        for args in args_list:
+            start = time.perf_counter()
+            func(*args)
+            times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    for args in args_list:
+        func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    times.sort()
+    return {
+        'lookups': len(times),
+        'mean_us': round(1e6 * sum(times) / len(times), 3),
+        'p95_us': round(1e6 * times[int(0.95 * (len(times) - 1))], 3),
+        'peak_kb': round(peak / 1024.0, 1),
+    }
+
+def bench_list(root, size, lookups, repeat):
+    results = dict()
+    entries = make_entries(size)
+    filename = write_list(root, entries)
+    relpaths = [ (entry_relpath(entry),) for entry in random.Random(1).sample(entries, min(lookups, size)) ]
+
+    # Building the index from the list, then loading it from its cache file
+    def build():
+        if path.exists(filename + compath.COMPATHS_INDEX_SUFFIX):
+            os.unlink(filename + compath.COMPATHS_INDEX_SUFFIX)
+        compath.load_compaths_index(filename)
+    results['index_%d' % size] = {
+        'build': measure(build, [()], 1, warmup=False),
+        'load': measure(lambda: compath.load_compaths_index(filename), [()], max(1, repeat // 10)),
+    }
+
+    # Lookups through a resolver without its result cache, so that every lookup searches the index
+    resolver = make_resolver(root, cache_size=0)
+    results['list_%d' % size] = measure(resolver.resolve, relpaths, repeat)
+
+    # The same lookups with the linear findpath scan used before the index
+    with open(filename) as list_file:
+        dirlist = [line.strip().rstrip('/') for line in list_file if line and not line.startswith('#')]
+    dirlist_parts = [ compath.getparts(dirpath) for dirpath in dirlist ]
+    pattern = compath.get_pattern('relpath')
+    def scan(relpath):
+        return compath.findpath(pattern.match(relpath).groupdict(), [dict(parts) for parts in dirlist_parts])
+    results['findpath_%d' % size] = measure(scan, relpaths, max(1, repeat // 10))
+    return results
+
+def bench_compath_var(root, size, lookups, repeat):
+    entries = make_entries(size, seed=2)
+    separators = ',:'
+    compath_var = ''.join(separators[i % 2] + entry_path(root, entry, 'h1')
+                          for i, entry in enumerate(entries)).lstrip(',')
+    relpaths = [ (entry_relpath(entry),) for entry in random.Random(3).sample(entries, min(lookups, size)) ]
+    aliases = make_aliases(root)
+    pattern = compath.get_pattern('relpath')
+    def lookup(relpath):
+        # Parse COMPATH for every lookup, as a new compath.py process does
+        compath.findpath(pattern.match(relpath).groupdict(), compath.get_compath_var_dirlist(compath_var, aliases),
+                         envir_sensitive=False)
+    return {'compath_%d' % size: measure(lookup, relpaths, repeat)}
+
+def bench_probe(root, lookups, repeat):
+    entries = [ ('probe%d' % i, 'v1.0', None, None) for i in range(lookups) ]
+    for i, entry in enumerate(entries):
+        os.makedirs(entry_path(root, entry, 'h1' if i % 2 else 'h2'), exist_ok=True)
+    relpaths = [ ('%s/%s' % entry[:2],) for entry in entries ]
+    # An empty list, so that every lookup falls through to the search of the COM directories
+    empty_list = root + '/empty.list'
+    open(empty_list, 'w').close()
+    uncached = make_resolver(root, empty_list, cache_size=0, probe_ttl=0)
+    cached = make_resolver(root, empty_list, cache_size=0, probe_ttl=3600)
+    for relpath in relpaths:
+        cached.resolve(relpath[0])
+    return {'probe': {
+        'uncached': measure(uncached.resolve, relpaths, repeat),
+        'cached': measure(cached.resolve, relpaths, repeat),
+    }}
+
+def bench_cold_start(root, size, repeat):
+    entries = make_entries(size)
+    write_list(root, entries)
+    script = ('import sys; sys.path.insert(0, %r); import compath; '
+              'r = compath.CompathResolver(aliases={}, compaths_list=%r, probe_cache=""); '
+              'r.resolve(%r, envir=%r)') % (ushdir, root + '/h1/ops/<envir>/config/compaths.list',
+                                             entry_relpath(entries[-1]), ENVIR)
+    times = list()
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', script])
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {'cold_start': {
+        'list_size': size,
+        'mean_us': round(1e6 * sum(times) / len(times), 3),
+        'p95_us': round(1e6 * times[int(0.95 * (len(times) - 1))], 3),
+        'maxrss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }}
+
+def compare(results, baseline, threshold, prefix=''):
+    """!Returns the names of the cases whose mean latency is more than threshold
+    times that of the baseline.
+    """
+    regressions = list()
+    for name, result in results.items():
+        if name not in baseline or not isinstance(result, dict):
+            continue
+        if 'mean_us' in result and baseline[name].get('mean_us'):
+            ratio = result['mean_us'] / baseline[name]['mean_us']
+            print('%-32s %12.1f us %8.2fx' % (prefix + name, result['mean_us'], ratio))
+            if ratio > threshold:
+                regressions.append(prefix + name)
+        else:
+            regressions.extend(compare(result, baseline[name], threshold, prefix + name + '.'))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark COM path resolution by compath.py.')
+    parser.add_argument('--root', metavar='dir', help='Directory in which to create the fake /lfs tree (default: a temporary directory)')
+    parser.add_argument('--output', metavar='file', default='bench_compath.json', help='JSON file to write the results to (default: bench_compath.json)')
+    parser.add_argument('--compare', metavar='file', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', metavar='ratio', type=float, default=1.5, help='Slowdown relative to --compare that counts as a regression (default: 1.5)')
+    parser.add_argument('--quick', action='store_true', help='Run small cases only, as a smoke test')
+    args = parser.parse_args()
+
+    if args.quick:
+        list_sizes, compath_sizes, lookups, repeat, cold_repeat = (100, 1000), (10, 100), 20, 2, 2
+    else:
+        list_sizes, compath_sizes, lookups, repeat, cold_repeat = (100, 1000, 10000, 50000), (10, 100, 500), 200, 10, 10
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = args.root or tmpdir
+        results = {
+            'python': platform.python_version(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        }
+        for size in list_sizes:
+            results.update(bench_list(root, size, lookups, repeat))
+        for size in compath_sizes:
+            results.update(bench_compath_var(root, size, lookups, repeat))
+        results.update(bench_probe(root, lookups, repeat))
+        results.update(bench_cold_start(root, list_sizes[-1], cold_repeat))
+
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+    print('Results written to', args.output)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+        if regressions:
+            print('Slower than', args.compare + ':', ', '.join(regressions))
+            sys.exit(1)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+#
+# This is a benchmark for the NCEPLIBS-prod_util project. It times the
+# copy of a set of files to a COM-like directory with a loop of cpfs
+# calls, as jobs do it now, and with a single "cpfs --bulk" call, and
+# writes the results to a JSON file so that releases can be compared.
+#
+# Usage:   bench_cpfs.py [--root dir] [--files N] [--size KB] [--jobs N]
+#                        [--output file] [--quick]
+#
+# cpfs needs $FSYNC to name a program that syncs a file; if it is not
+# set, "sync" is used.  Each case records the wall time of the whole
+# copy in seconds, and the files copied per second:
+#   loop:   one cpfs call per file
+#   bulk:   one cpfs --bulk call for all the files
+# The copies are checked against their sources after each case.
+
+import argparse, filecmp, json, os, platform, shutil, subprocess, tempfile, time
+from os import path
+
+ushdir = path.join(path.dirname(path.abspath(__file__)), '..', 'ush')
+
+def make_sources(root, count, size_kb):
+    source_dir = path.join(root, 'src')
+    os.makedirs(source_dir, exist_ok=True)
+    sources = list()
+    for i in range(count):
+        source = path.join(source_dir, 'gfs.t00z.pgrb2.0p25.f%03d' % i)
+        with open(source, 'wb') as source_file:
+            source_file.write(os.urandom(size_kb * 1024))
+        sources.append(source)
+    return sources
+
+def fresh_directory(root, name):
+    directory = path.join(root, name)
+    if path.exists(directory):
+        shutil.rmtree(directory)
+    os.makedirs(directory)
+    return directory
+
+def check(sources, directory):
+    for source in sources:
+        if not filecmp.cmp(source, path.join(directory, path.basename(source)), shallow=False):
+            raise RuntimeError('Copy of ' + source + ' does not match')
+    if any(name.endswith('.cptmp') for name in os.listdir(directory)):
+        raise RuntimeError('Temporary files were left in ' + directory)
+
+def result(seconds, count):
+    return {'files': count, 'seconds': round(seconds, 4), 'files_per_second': round(count / seconds, 1)}
+
+def bench_loop(root, sources, environ):
+    directory = fresh_directory(root, 'loop')
+    start = time.perf_counter()
+    for source in sources:
+        subprocess.check_call(['sh', path.join(ushdir, 'cpfs'), source, directory], env=environ)
+    seconds = time.perf_counter() - start
+    check(sources, directory)
+    return result(seconds, len(sources))
+
+def bench_bulk(root, sources, jobs, environ):
+    directory = fresh_directory(root, 'bulk')
+    start = time.perf_counter()
+    subprocess.check_call(['sh', path.join(ushdir, 'cpfs'), '--bulk', '-j', str(jobs), '-t', directory] + sources, env=environ)
+    seconds = time.perf_counter() - start
+    check(sources, directory)
+    return result(seconds, len(sources))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark cpfs against cpfs --bulk.')
+    parser.add_argument('--root', metavar='dir', help='Directory in which to create the files (default: a temporary directory)')
+    parser.add_argument('--files', metavar='N', type=int, default=200, help='Number of files to copy (default: 200)')
+    parser.add_argument('--size', metavar='KB', type=int, default=1024, help='Size of each file in kilobytes (default: 1024)')
+    parser.add_argument('--jobs', metavar='N', type=int, default=8, help='Number of files cpfs --bulk copies at once (default: 8)')
+    parser.add_argument('--output', metavar='file', default='bench_cpfs.json', help='JSON file to write the results to (default: bench_cpfs.json)')
+    parser.add_argument('--quick', action='store_true', help='Copy a few small files only, as a smoke test')
+    args = parser.parse_args()
+    if args.quick:
+        args.files, args.size = 20, 64
+
+    environ = dict(os.environ)
+    environ['PATH'] = ushdir + os.pathsep + environ.get('PATH', '')
+    environ.setdefault('FSYNC', 'sync')
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = args.root or tmpdir
+        sources = make_sources(root, args.files, args.size)
+        results = {
+            'python': platform.python_version(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'size_kb': args.size,
+            'jobs': args.jobs,
+            'loop': bench_loop(root, sources, environ),
+            'bulk': bench_bulk(root, sources, args.jobs, environ),
+        }
+    results['speedup'] = round(results['loop']['seconds'] / results['bulk']['seconds'], 2)
+
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+    print('loop: %(seconds).3f s' % results['loop'], ' bulk: %(seconds).3f s' % results['bulk'],
+          ' speedup: %.2fx' % results['speedup'])
+    print('Results written to', args.output)
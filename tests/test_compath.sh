@@ -0,0 +1,151 @@
+#!/bin/bash
+#
+# This is a test for the NCEPLIBS-prod_util project. This test runs
+# compath.py against a fake COM tree and compaths.list, using the
+# CompathResolver class so that it can run off of WCOSS.
+set -x
+exe=${1:-compath.py}
+ushdir=$(cd $(dirname $(command -v $exe)) && pwd)
+
+testroot=$(mktemp -d)
+trap "rm -rf $testroot" EXIT
+export COMPATH_PROBE_CACHE=
+mkdir -p $testroot/h1/ops/prod/config $testroot/h1/ops/prod/com/gfs/v16.2/gfs.20230101 \
+         $testroot/h2/ops/prod/com/gfs/v16.2/gdas.20230101 $testroot/h2/ops/prod/com/rap/v5.1/rap.20230101
+cat > $testroot/h1/ops/prod/config/compaths.list <<EOL
+# test list
+$testroot/h1/ops/prod/com/gfs/v16.2
+$testroot/h2/ops/prod/com/gfs/v16.2/gdas
+EOL
+
+compath() {
+  PYTHONPATH=$ushdir python3 - "$@" <<EOL
+import sys
+import compath
+from compath import CompathResolver, CompathError
+resolver = CompathResolver(aliases={'/comh1': '$testroot/h1/ops/<envir>/com', '/comh2': '$testroot/h2/ops/<envir>/com'},
+                           compaths_list='$testroot/h1/ops/<envir>/config/compaths.list')
+if sys.argv[1:] == ['--batch']:
+    compath._default_resolver = resolver
+    sys.exit(compath.run_batch(open('$testroot/batch')))
+try:
+    for relpath in sys.argv[1:]:
+        print(resolver.resolve(relpath))
+except CompathError as err:
+    print(err)
+    sys.exit(1)
+EOL
+}
+
+# A) RUN entry in the list
+COMPATH_REF_A=$testroot/h2/ops/prod/com/gfs/v16.2/gdas.20230101
+COMPATH_TEST_A=$(compath gfs/v16.2.4/gdas.20230101)
+if [ "$COMPATH_REF_A" == "$COMPATH_TEST_A" ]; then
+  pass=A
+else
+  echo "compath (test A) reference output '$COMPATH_REF_A' does not match test output '$COMPATH_TEST_A'"
+fi
+
+# B) NET/version entry in the list; the list index is read from its cache
+COMPATH_REF_B=$testroot/h1/ops/prod/com/gfs/v16.2/gfs.20230101/00
+COMPATH_TEST_B=$(compath gfs/v16.2/gfs.20230101/00)
+if [ "$COMPATH_REF_B" == "$COMPATH_TEST_B" ] && [ -s $testroot/h1/ops/prod/config/compaths.list.index ]; then
+  pass=${pass}B
+else
+  echo "compath (test B) reference output '$COMPATH_REF_B' does not match test output '$COMPATH_TEST_B'"
+fi
+
+# C) COMPATH takes precedence over the list, with aliases expanded
+COMPATH_REF_C=$testroot/h2/ops/prod/com/gfs/v16.2/gfs.20230101
+COMPATH_TEST_C=$(COMPATH=/comh2/gfs compath gfs/v16.2/gfs.20230101)
+if [ "$COMPATH_REF_C" == "$COMPATH_TEST_C" ]; then
+  pass=${pass}C
+else
+  echo "compath (test C) reference output '$COMPATH_REF_C' does not match test output '$COMPATH_TEST_C'"
+fi
+
+# D) Search of the COM directories when the list has no match
+COMPATH_REF_D=$testroot/h2/ops/prod/com/rap/v5.1/rap.20230101
+COMPATH_TEST_D=$(compath rap/v5.1/rap.20230101)
+if [ "$COMPATH_REF_D" == "$COMPATH_TEST_D" ]; then
+  pass=${pass}D
+else
+  echo "compath (test D) reference output '$COMPATH_REF_D' does not match test output '$COMPATH_TEST_D'"
+fi
+
+# E) Batch mode reports each failure on its own line
+COMPATH_REF_E="$(printf 'gfs/v16.2/x\tERROR: Could not find gfs/v16.2/x\nbad\tERROR: The relative COM path provided (bad) is not formatted correctly.')"
+printf 'gfs/v16.2/x\nbad\n' > $testroot/batch
+COMPATH_TEST_E=$(envir=test compath --batch 2>/dev/null | grep ERROR)
+if [ "$COMPATH_REF_E" == "$COMPATH_TEST_E" ]; then
+  pass=${pass}E
+else
+  echo "compath (test E) reference output '$COMPATH_REF_E' does not match test output '$COMPATH_TEST_E'"
+fi
+
+# F) An index file whose index is not a dictionary is rebuilt instead of trusted
+python3 -c "
+import json
+filename = '$testroot/h1/ops/prod/config/compaths.list.index'
+cache = json.load(open(filename))
+cache['index'] = []
+json.dump(cache, open(filename, 'w'))"
+COMPATH_TEST_F=$(compath gfs/v16.2/gfs.20230101/00)
+if [ "$COMPATH_REF_B" == "$COMPATH_TEST_F" ]; then
+  pass=${pass}F
+else
+  echo "compath (test F) reference output '$COMPATH_REF_B' does not match test output '$COMPATH_TEST_F'"
+fi
+
+# G) compathd.py sends the warnings of a lookup to the client instead of printing them
+COMPATH_REF_G="$(printf '2\tWARNING: Could not find the test COM paths list at %s\n1\tCould not find gfs/v16.2/gfs.20230101' \
+                 $testroot/h1/ops/test/config/compaths.list)"
+COMPATH_TEST_G=$(PYTHONPATH=$ushdir python3 - 2> $testroot/compathd.err <<EOL
+import socket, threading
+from compath import CompathResolver
+from compathd import CompathServer
+resolver = CompathResolver(aliases={'/comh1': '$testroot/h1/ops/<envir>/com'},
+                           compaths_list='$testroot/h1/ops/<envir>/config/compaths.list')
+server = CompathServer('$testroot/compathd.sock', resolver)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+client.connect('$testroot/compathd.sock')
+client.sendall(b'-\ttest\tgfs/v16.2/gfs.20230101\t\t\t\n')
+client.shutdown(socket.SHUT_WR)
+print(client.makefile().read(), end='')
+EOL
+)
+if [ "$COMPATH_REF_G" == "$COMPATH_TEST_G" ] && [ ! -s $testroot/compathd.err ]; then
+  pass=${pass}G
+else
+  echo "compath (test G) reference output '$COMPATH_REF_G' does not match test output '$COMPATH_TEST_G'"
+fi
+
+# H) A COM directory that hangs is waited for once, then skipped with the same warning
+COMPATH_REF_H="True 2 3"
+COMPATH_TEST_H=$(PYTHONPATH=$ushdir python3 - 2>/dev/null <<EOL
+import threading, time
+import compath
+exists = compath.path.exists
+compath.path.exists = lambda fullpath: time.sleep(5) if '/h2/' in fullpath else exists(fullpath)
+resolver = compath.CompathResolver(aliases={'/comh1': '$testroot/h1/ops/<envir>/com', '/comh2': '$testroot/h2/ops/<envir>/com'},
+                                   compaths_list='$testroot/h1/ops/<envir>/config/compaths.list', probe_timeout=0.5)
+warnings = list()
+start = time.time()
+for i in range(3):
+    try:
+        resolver.resolve_with_source('rap/v5.1/rap.20230101', warn=warnings.append)
+    except compath.CompathError:
+        pass
+print(time.time() - start < 1, threading.active_count(), sum('Timed out' in warning for warning in warnings))
+EOL
+)
+if [ "$COMPATH_REF_H" == "$COMPATH_TEST_H" ]; then
+  pass=${pass}H
+else
+  echo "compath (test H) reference output '$COMPATH_REF_H' does not match test output '$COMPATH_TEST_H'"
+fi
+
+if [ "$pass" != ABCDEFGH ]; then
+  exit 1
+fi
@@ -0,0 +1,78 @@
+#!/bin/bash
+#
+# This is a test for the NCEPLIBS-prod_util project. This test runs the
+# fake dbn_alert with DBNLOG=YES, and checks its log, that compath.py is
+# run once per job, and its handling of empty and missing files.
+set -x
+exe=${1:-dbn_alert}
+
+testroot=$(mktemp -d)
+trap "rm -rf $testroot" EXIT
+mkdir $testroot/bin
+cat > $testroot/bin/compath.py <<EOL
+#!/bin/bash
+echo called >> $testroot/compath.calls
+echo \$COMROOT/\$2
+EOL
+cat > $testroot/bin/err_exit <<EOL
+#!/bin/bash
+echo "err_exit \$*" >> $testroot/err_exit.calls
+EOL
+chmod +x $testroot/bin/*
+export PATH=$testroot/bin:$PATH
+export DBNLOG=YES COMROOT=$testroot/com NET=gfs gfs_ver=v16.3 RUN=gfs PDY=20240101 cyc=06 job=jgfs_post DATA=$testroot
+unset NODBNFCHK DBNLOG_CACHE
+log_file=$testroot/com/gfs/v16.3/gfs.20240101/dbnlogs/jgfs_post.2024010106.dbnlog
+echo data > $testroot/product
+: > $testroot/empty
+
+# A) An alert is printed and logged
+DBN_REF_A="FAKE dbn_alert MODEL GFS_PGB2 jgfs_post $testroot/product"
+DBN_TEST_A=$($exe MODEL GFS_PGB2 jgfs_post $testroot/product)
+if [ "$DBN_REF_A" == "$DBN_TEST_A" ] && grep -q "^\[..:..:..\] MODEL GFS_PGB2 jgfs_post $testroot/product$" $log_file; then
+  pass=A
+else
+  echo "dbn_alert (test A) reference output '$DBN_REF_A' does not match test output '$DBN_TEST_A'"
+fi
+
+# B) Alerts given through --batch are all logged, without running compath.py again
+for i in $(seq 500); do echo "MODEL GFS_PGB2 jgfs_post $testroot/product"; done | $exe --batch > /dev/null
+if [ $(wc -l < $log_file) -eq 501 ] && [ $(wc -l < $testroot/compath.calls) -eq 1 ]; then
+  pass=${pass}B
+else
+  echo "dbn_alert (test B) log lines '$(wc -l < $log_file)' or compath.py calls '$(wc -l < $testroot/compath.calls)' are not as expected"
+fi
+
+# C) An empty file gives a warning
+DBN_REF_C="WARNING: $testroot/empty is empty (it has a size of zero bytes)"
+DBN_TEST_C=$($exe MODEL GFS_PGB2 jgfs_post $testroot/empty 2>&1 >/dev/null)
+if [ "$DBN_REF_C" == "$DBN_TEST_C" ]; then
+  pass=${pass}C
+else
+  echo "dbn_alert (test C) reference output '$DBN_REF_C' does not match test output '$DBN_TEST_C'"
+fi
+
+# D) A missing file runs err_exit, or gives a warning with NODBNFCHK=YES
+$exe MODEL GFS_PGB2 jgfs_post $testroot/missing
+DBN_REF_D="WARNING: $testroot/missing is not exist"
+DBN_TEST_D=$(NODBNFCHK=YES $exe MODEL GFS_PGB2 jgfs_post $testroot/missing 2>&1 >/dev/null)
+if [ "$(cat $testroot/err_exit.calls)" == "err_exit Fake dbn_alert could not find $testroot/missing" ] && [ "$DBN_REF_D" == "$DBN_TEST_D" ]; then
+  pass=${pass}D
+else
+  echo "dbn_alert (test D) reference output '$DBN_REF_D' does not match test output '$DBN_TEST_D'"
+fi
+
+# E) A cache file that others may write to is ignored, and the log goes to the job's directory
+rm $log_file $testroot/compath.calls
+echo '{"key": ["'$testroot'/com", "gfs/v16.3/gfs.20240101/dbnlogs/", null], "outputdir": "'$testroot'/planted"}' > $testroot/planted.json
+chmod 666 $testroot/planted.json
+DBNLOG_CACHE=$testroot/planted.json $exe MODEL GFS_PGB2 jgfs_post $testroot/product > /dev/null
+if [ $(wc -l < $log_file) -eq 1 ] && [ $(wc -l < $testroot/compath.calls) -eq 1 ] && [ ! -e $testroot/planted ]; then
+  pass=${pass}E
+else
+  echo "dbn_alert (test E) log '$(cat $log_file)' or planted directory '$(ls $testroot/planted)' are not as expected"
+fi
+
+if [ "$pass" != ABCDE ]; then
+  exit 1
+fi
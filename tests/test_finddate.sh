@@ -0,0 +1,74 @@
+#!/bin/bash
+#
+# This is a test for the NCEPLIBS-prod_util project. This test runs
+# finddate.sh and proddate.py setpdy, and compares their output with
+# dates computed by GNU date.
+set -x
+exe=${1:-finddate.sh}
+ushdir=$(cd $(dirname $(command -v $exe)) && pwd)
+export PATH=$ushdir:$PATH
+
+testroot=$(mktemp -d)
+trap "rm -rf $testroot" EXIT
+
+# A) A sequence of days forward across a leap day
+FINDDATE_REF_A="20240228 20240229 20240301"
+FINDDATE_TEST_A=$($exe 20240227 s+3)
+if [ "$FINDDATE_REF_A" == "$FINDDATE_TEST_A" ]; then
+  pass=A
+else
+  echo "finddate (test A) reference output '$FINDDATE_REF_A' does not match test output '$FINDDATE_TEST_A'"
+fi
+
+# B) A sequence of 90 days backward, as GNU date gives it
+FINDDATE_REF_B=$(for p in $(seq 90); do date -d "20230115 -${p} days" +%Y%m%d; done | xargs)
+FINDDATE_TEST_B=$($exe 20230115 s-90)
+if [ "$FINDDATE_REF_B" == "$FINDDATE_TEST_B" ]; then
+  pass=${pass}B
+else
+  echo "finddate (test B) reference output '$FINDDATE_REF_B' does not match test output '$FINDDATE_TEST_B'"
+fi
+
+# C) A single day, and the message for an invalid argument
+FINDDATE_REF_C="19991231 Second argument of second input must be '+' or '-'. You use *."
+FINDDATE_TEST_C="$($exe 20000101 d-1) $($exe 20000101 's*1')"
+if [ "$FINDDATE_REF_C" == "$FINDDATE_TEST_C" ] && ! $exe 20230229 d+1 2>/dev/null; then
+  pass=${pass}C
+else
+  echo "finddate (test C) reference output '$FINDDATE_REF_C' does not match test output '$FINDDATE_TEST_C'"
+fi
+
+# D) The PDY file of setpdy.sh
+(cd $testroot && proddate.py setpdy 20240301 2 1)
+FINDDATE_REF_D="export PDYm2=20240228
+export PDYm1=20240229
+export PDY=20240301
+export PDYp1=20240302"
+FINDDATE_TEST_D=$(cat $testroot/PDY)
+if [ "$FINDDATE_REF_D" == "$FINDDATE_TEST_D" ] && [ -x $testroot/PDY ]; then
+  pass=${pass}D
+else
+  echo "finddate (test D) reference output '$FINDDATE_REF_D' does not match test output '$FINDDATE_TEST_D'"
+fi
+
+# E) Dates past the year 9999 are printed as GNU date prints them
+FINDDATE_REF_E="$(date -d '20230101 +9999999 days' +%Y%m%d) $(date -d '99991230 +1 days' +%Y%m%d) $(date -d '99991230 +2 days' +%Y%m%d)"
+FINDDATE_TEST_E="$($exe 20230101 d+9999999) $($exe 99991230 s+2)"
+if [ "$FINDDATE_REF_E" == "$FINDDATE_TEST_E" ]; then
+  pass=${pass}E
+else
+  echo "finddate (test E) reference output '$FINDDATE_REF_E' does not match test output '$FINDDATE_TEST_E'"
+fi
+
+# F) In the C locale, date's message for an invalid date is quoted as date quotes it
+FINDDATE_REF_F=$(env -u LC_ALL -u LC_CTYPE LANG=C date -d 20230230 2>&1)
+FINDDATE_TEST_F=$(env -u LC_ALL -u LC_CTYPE LANG=C $exe 20230230 d+1 2>&1)
+if [ "$FINDDATE_REF_F" == "$FINDDATE_TEST_F" ]; then
+  pass=${pass}F
+else
+  echo "finddate (test F) reference output '$FINDDATE_REF_F' does not match test output '$FINDDATE_TEST_F'"
+fi
+
+if [ "$pass" != ABCDEF ]; then
+  exit 1
+fi
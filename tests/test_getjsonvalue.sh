@@ -0,0 +1,64 @@
+#!/bin/bash
+#
+# This is a test for the NCEPLIBS-prod_util project. This test runs
+# getjsonvalue on a small document, with the original positional keys
+# and with several --path lookups in one pass.
+set -x
+exe=${1:-getjsonvalue}
+
+testroot=$(mktemp -d)
+trap "rm -rf $testroot" EXIT
+cat > $testroot/test.json <<'EOL'
+{"job": {"name": "jgfs_fcst", "cyc": 12, "resources": {"fcst": {"ncpus": 128}, "post": {"ncpus": 16}}},
+ "files": [{"path": "/tmp/a b"}, {"path": "$HOME's"}],
+ "done": true}
+EOL
+
+# A) The original usage, with the document on stdin
+GETJSONVALUE_REF_A=jgfs_fcst
+GETJSONVALUE_TEST_A=$(cat $testroot/test.json | $exe job name)
+if [ "$GETJSONVALUE_REF_A" == "$GETJSONVALUE_TEST_A" ]; then
+  pass=A
+else
+  echo "getjsonvalue (test A) reference output '$GETJSONVALUE_REF_A' does not match test output '$GETJSONVALUE_TEST_A'"
+fi
+
+# B) Several paths, with an index, a wildcard and quoting, read as shell assignments
+eval "$($exe -p job.cyc -p FILE=files[1].path -p 'job.resources.*.ncpus' -p done $testroot/test.json < /dev/null)"
+if [ "$job_cyc" == 12 ] && [ "$FILE" == "\$HOME's" ] && [ "${job_resources_ncpus[*]}" == "128 16" ] && [ "$done" == true ]; then
+  pass=${pass}B
+else
+  echo "getjsonvalue (test B) output '$job_cyc' '$FILE' '${job_resources_ncpus[*]}' '$done' does not match '12' '\$HOME's' '128 16' 'true'"
+fi
+
+# C) JSON output
+GETJSONVALUE_REF_C='{"first": "/tmp/a b", "paths": ["/tmp/a b", "$HOME'"'"'s"]}'
+GETJSONVALUE_TEST_C=$($exe -f json -p first=files[0].path -p 'paths=files[*].path' < $testroot/test.json | python3 -c 'import json, sys; print(json.dumps(json.load(sys.stdin)))')
+if [ "$GETJSONVALUE_REF_C" == "$GETJSONVALUE_TEST_C" ]; then
+  pass=${pass}C
+else
+  echo "getjsonvalue (test C) reference output '$GETJSONVALUE_REF_C' does not match test output '$GETJSONVALUE_TEST_C'"
+fi
+
+# D) A missing path is an error
+if ! $exe -p job.missing $testroot/test.json < /dev/null; then
+  pass=${pass}D
+else
+  echo "getjsonvalue (test D) did not fail for a missing path"
+fi
+
+# E) A number cut by the end of the first 64 KiB chunk is read whole
+python3 -c "
+prefix = '{\"pad\": \"%s\", \"x\": -25000000000'
+print(prefix % ('a' * (65535 - len(prefix % ''))) + '.5}')" > $testroot/big.json
+GETJSONVALUE_REF_E=x=-25000000000.5
+GETJSONVALUE_TEST_E=$($exe -p x $testroot/big.json < /dev/null)
+if [ "$GETJSONVALUE_REF_E" == "$GETJSONVALUE_TEST_E" ]; then
+  pass=${pass}E
+else
+  echo "getjsonvalue (test E) reference output '$GETJSONVALUE_REF_E' does not match test output '$GETJSONVALUE_TEST_E'"
+fi
+
+if [ "$pass" != ABCDE ]; then
+  exit 1
+fi
@@ -0,0 +1,91 @@
+#!/bin/bash
+#
+# This is a test for the NCEPLIBS-prod_util project. This test looks up
+# the job context used by mail.py with a fake qstat, and checks that the
+# lookup is made once per job and reused from the job's cache file, and
+# that a failed lookup is retried after a while.
+set -x
+exe=${1:-mail.py}
+ushdir=$(cd $(dirname $(command -v $exe)) && pwd)
+
+testroot=$(mktemp -d)
+trap "rm -rf $testroot" EXIT
+cat > $testroot/qstat <<EOL
+#!/bin/bash
+echo called >> $testroot/qstat.calls
+cat <<EOF2
+Job Id: \$2
+    Job_Name = jgfs_fcst
+    Output_Path = dlogin01:/lfs/h1/ops/prod/output/20230101/gfs_fcst.o\$2
+    queue = prod
+EOF2
+EOL
+chmod +x $testroot/qstat
+export QSTAT=$testroot/qstat DATA=$testroot
+unset ECF_JOBOUT PBS_JOBID PBS_JOBNAME PBS_QUEUE PBS_O_HOST PBS_O_WORKDIR
+
+context() {
+  PYTHONPATH=$ushdir python3 -c "import mail; print(mail.get_job_context('$1').get('output_path', 'Job ran locally'))"
+}
+
+# A) The output path comes from qstat
+MAIL_REF_A=/lfs/h1/ops/prod/output/20230101/gfs_fcst.o123.dbqs01
+MAIL_TEST_A=$(context 123.dbqs01)
+if [ "$MAIL_REF_A" == "$MAIL_TEST_A" ]; then
+  pass=A
+else
+  echo "mail (test A) reference output '$MAIL_REF_A' does not match test output '$MAIL_TEST_A'"
+fi
+
+# B) A later call in the same job reads the cache file instead of running qstat
+MAIL_TEST_B=$(context 123.dbqs01)
+if [ "$MAIL_REF_A" == "$MAIL_TEST_B" ] && [ $(wc -l < $testroot/qstat.calls) -eq 1 ]; then
+  pass=${pass}B
+else
+  echo "mail (test B) output '$MAIL_TEST_B' or qstat calls '$(wc -l < $testroot/qstat.calls)' are not as expected"
+fi
+
+# C) ECF_JOBOUT is used without running qstat
+MAIL_REF_C=$testroot/gfs_fcst.1
+MAIL_TEST_C=$(ECF_JOBOUT=$MAIL_REF_C context 456.dbqs01)
+if [ "$MAIL_REF_C" == "$MAIL_TEST_C" ] && [ $(wc -l < $testroot/qstat.calls) -eq 1 ]; then
+  pass=${pass}C
+else
+  echo "mail (test C) reference output '$MAIL_REF_C' does not match test output '$MAIL_TEST_C'"
+fi
+
+# D) A failed qstat means the job ran locally
+MAIL_REF_D="Job ran locally"
+MAIL_TEST_D=$(QSTAT=false context 789.dbqs01)
+if [ "$MAIL_REF_D" == "$MAIL_TEST_D" ]; then
+  pass=${pass}D
+else
+  echo "mail (test D) reference output '$MAIL_REF_D' does not match test output '$MAIL_TEST_D'"
+fi
+
+# E) The failed lookup is reused for a minute, then qstat is asked again
+MAIL_TEST_E=$(context 789.dbqs01)
+sed -i 's/"time": [0-9.]*/"time": 0/' $testroot/.mail_job_context.$(id -u).789.dbqs01.json
+MAIL_REF_E=/lfs/h1/ops/prod/output/20230101/gfs_fcst.o789.dbqs01
+if [ "$MAIL_TEST_E" == "Job ran locally" ] && [ "$(context 789.dbqs01)" == "$MAIL_REF_E" ]; then
+  pass=${pass}E
+else
+  echo "mail (test E) output '$MAIL_TEST_E' or cache file '$(cat $testroot/.mail_job_context.*.789.dbqs01.json)' are not as expected"
+fi
+
+# F) A cache file that others may write to is not trusted
+cat > $testroot/.mail_job_context.$(id -u).999.dbqs01.json <<EOL
+{"job": "999.dbqs01", "context": {"output_path": "/planted"}, "time": 0}
+EOL
+chmod 666 $testroot/.mail_job_context.$(id -u).999.dbqs01.json
+MAIL_REF_F=/lfs/h1/ops/prod/output/20230101/gfs_fcst.o999.dbqs01
+MAIL_TEST_F=$(context 999.dbqs01)
+if [ "$MAIL_REF_F" == "$MAIL_TEST_F" ]; then
+  pass=${pass}F
+else
+  echo "mail (test F) reference output '$MAIL_REF_F' does not match test output '$MAIL_TEST_F'"
+fi
+
+if [ "$pass" != ABCDEF ]; then
+  exit 1
+fi
@@ -0,0 +1,170 @@
+#!/bin/bash
+#
+# This is a test for the NCEPLIBS-prod_util project. This test spools
+# messages as mail.py does and delivers them with mailspool.py to a
+# local SMTP server that saves each message it receives, checking the
+# retries, the digests of similar messages, and the rate limit.
+set -x
+exe=${1:-mailspool.py}
+ushdir=$(cd $(dirname $(command -v $exe)) && pwd)
+
+testroot=$(mktemp -d)
+spool=$testroot/spool
+inbox=$testroot/inbox
+mkdir $inbox
+unset MAILSPOOL_WINDOW MAILSPOOL_RATE
+
+# A minimal SMTP server that writes each message to a file in $inbox
+cat > $testroot/smtpsink.py <<EOF
+import socketserver, sys, time
+class Handler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+    def handle(self):
+        self.reply('220 smtpsink')
+        data = None
+        for line in self.rfile:
+            line = line.decode().rstrip('\r\n')
+            if data is not None:
+                if line == '.':
+                    with open('$inbox/%.6f' % time.time(), 'w') as message:
+                        message.write('\n'.join(data) + '\n')
+                    data = None
+                    self.reply('250 OK')
+                else:
+                    data.append(line[1:] if line.startswith('..') else line)
+            elif line.upper() == 'DATA':
+                data = []
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+            elif line.upper() == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+server = socketserver.ThreadingTCPServer(('localhost', 0), Handler)
+print(server.server_address[1], flush=True)
+server.serve_forever()
+EOF
+python3 $testroot/smtpsink.py > $testroot/smtpsink.port &
+sink=$!
+trap "kill $sink; rm -rf $testroot" EXIT
+for i in $(seq 50); do [ -s $testroot/smtpsink.port ] && break; sleep 0.1; done
+export MAILRELAY=localhost:$(cat $testroot/smtpsink.port)
+
+spool() {
+  PYTHONPATH=$ushdir python3 -c "import mailspool; mailspool.spool_message('$spool', 'ops@noaa.gov', ['$1@noaa.gov'], 'Subject: $2\n\n$3\n')"
+}
+
+# Spools a message as mail.py does, so that it may be coalesced: spool_alert spool recipient subject ecflow_task
+spool_alert() {
+  PYTHONPATH=$ushdir python3 -c "
+import mailspool
+mailspool.spool_message('$1', 'ops@noaa.gov', ['$2@noaa.gov'], 'Subject: $3\n\nFailed\n', subject='$3', body='Failed',
+                        job_info=[('ecFlow Task', '$4')])"
+}
+
+# A) A spooled message is delivered through the relay and leaves the spool
+spool a "test A" 'Quotes " and $dollar signs'
+$exe -s $spool --once
+if grep -q '^Subject: test A$' $inbox/* && grep -q 'Quotes " and $dollar signs' $inbox/* && [ -z "$(ls $spool/new)$(ls $spool/cur)" ]; then
+  pass=A
+else
+  echo "mailspool (test A) inbox '$(cat $inbox/*)' or spool '$(ls $spool/*)' are not as expected"
+fi
+
+# B) A message spooled while a worker still holds the lock is seen once the worker lets go
+MAILSPOOL_TEST_B=$(PYTHONPATH=$ushdir python3 -c "
+import mailspool
+worker = mailspool.SpoolWorker('$spool')
+worker.lock()
+worker.drain(once=True)
+mailspool.spool_message('$spool', 'ops@noaa.gov', ['b@noaa.gov'], 'Subject: test B\n\nB\n')
+print(mailspool.worker_running('$spool'), worker.unlock())")
+$exe -s $spool --once
+if [ "$MAILSPOOL_TEST_B" == "True True" ] && grep -q '^Subject: test B$' $inbox/*; then
+  pass=${pass}B
+else
+  echo "mailspool (test B) output '$MAILSPOOL_TEST_B' or inbox '$(cat $inbox/*)' are not as expected"
+fi
+
+# C) When the relay cannot be reached, the message is kept for a later attempt
+spool c "test C" C
+MAILRELAY=localhost:1 $exe -s $spool --once 2> $testroot/worker.err
+if [ $(ls $spool/new | wc -l) -eq 1 ] && grep -q '"attempts": 1' $spool/new/* && grep -q "retrying in 30 seconds" $testroot/worker.err; then
+  pass=${pass}C
+else
+  echo "mailspool (test C) spool '$(cat $spool/new/*)' is not as expected"
+fi
+
+# D) Similar messages are sent as one digest, and those that follow in the window are held
+for jobid in 101 102 103; do
+  spool_alert $testroot/spoolD d "jgfs_fcst $jobid failed" /prod/gfs/fcst_$jobid
+done
+$exe -s $testroot/spoolD --once
+spool_alert $testroot/spoolD d "jgfs_fcst 104 failed" /prod/gfs/fcst_104
+$exe -s $testroot/spoolD --once
+if [ $(grep -l '^Subject: jgfs_fcst 101 failed \[3 messages\]$' $inbox/* | wc -l) -eq 1 ] && grep -q '/prod/gfs/fcst_103' $inbox/* &&
+   [ $(grep -l '^Subject: jgfs_fcst' $inbox/* | wc -l) -eq 1 ] && [ $(ls $testroot/spoolD/new | wc -l) -eq 1 ]; then
+  pass=${pass}D
+else
+  echo "mailspool (test D) inbox '$(cat $inbox/*)' or spool '$(ls $testroot/spoolD/new)' are not as expected"
+fi
+
+# E) A repeat of a message sent in the window is dropped
+spool_alert $testroot/spoolD d "jgfs_fcst 999 failed" /prod/gfs/fcst_101
+$exe -s $testroot/spoolD --once 2> $testroot/worker.err
+if grep -q "Dropping .* which repeats a message already sent" $testroot/worker.err && [ $(ls $testroot/spoolD/new | wc -l) -eq 1 ]; then
+  pass=${pass}E
+else
+  echo "mailspool (test E) worker output '$(cat $testroot/worker.err)' is not as expected"
+fi
+
+# F) A window of 0 turns coalescing off
+for jobid in 201 202; do
+  spool_alert $testroot/spoolF f "jgdas_fcst $jobid failed" /prod/gdas/fcst_$jobid
+done
+MAILSPOOL_WINDOW=0 $exe -s $testroot/spoolF --once
+if [ $(grep -l '^Subject: jgdas_fcst 20[12] failed$' $inbox/* | wc -l) -eq 2 ] && ! grep -q '^Subject: jgdas_fcst.*messages' $inbox/*; then
+  pass=${pass}F
+else
+  echo "mailspool (test F) inbox '$(grep '^Subject: jgdas' $inbox/*)' is not as expected"
+fi
+
+# G) A recipient over the rate limit is not sent more until the hour has passed
+spool=$testroot/spoolG
+spool g "test G1" G1
+spool g "test G2" G2
+$exe -s $testroot/spoolG --rate 1 --once
+$exe -s $testroot/spoolG --rate 1 --once
+if [ $(grep -l '^Subject: test G' $inbox/* | wc -l) -eq 1 ] && [ $(ls $testroot/spoolG/new | wc -l) -eq 1 ]; then
+  pass=${pass}G
+else
+  echo "mailspool (test G) inbox '$(grep '^Subject: test G' $inbox/*)' is not as expected"
+fi
+
+# H) The worker reads each waiting message once, not on every pass over the spool
+spool=$testroot/spoolH
+spool h "test H1" H1
+spool h "test H2" H2
+MAILSPOOL_TEST_H=$(PYTHONPATH=$ushdir python3 -c "
+import builtins, mailspool
+worker = mailspool.SpoolWorker('$spool')
+worker.lock()
+reads = list()
+real_open = builtins.open
+builtins.open = lambda filename, *args, **kwargs: reads.append(filename) or real_open(filename, *args, **kwargs)
+counts = [ (len(worker.pending()), len(reads)) ]
+counts.append((len(worker.pending()), len(reads)))
+mailspool.spool_message('$spool', 'ops@noaa.gov', ['h@noaa.gov'], 'Subject: test H3\n\nH3\n')
+reads.clear()
+counts.append((len(worker.pending()), len(reads)))
+print(counts)")
+if [ "$MAILSPOOL_TEST_H" == "[(2, 2), (2, 2), (3, 1)]" ]; then
+  pass=${pass}H
+else
+  echo "mailspool (test H) messages and reads '$MAILSPOOL_TEST_H' are not as expected"
+fi
+
+if [ "$pass" != ABCDEFGH ]; then
+  exit 1
+fi
@@ -0,0 +1,88 @@
+#!/bin/bash
+#
+# This is a test for the NCEPLIBS-prod_util project. This test runs
+# postmsg from many writers at once through the postmsgd.py collector,
+# and checks the lines written and the direct append used for long
+# lines and when no collector is running.
+set -x
+exe=${1:-postmsg}
+client=${2:-postmsgc}
+ushdir=$(cd $(dirname $(command -v $exe)) && pwd)
+clientdir=$(cd $(dirname $(command -v $client)) && pwd)
+export PATH=$clientdir:$ushdir:$PATH
+
+testroot=$(mktemp -d)
+export POSTMSGD_SOCKET=$testroot/postmsgd.sock jobid=jgfs_fcst_00.12345
+line_format='^[01][0-9]/[0-3][0-9] [0-2][0-9]:[0-5][0-9]:[0-5][0-9]Z jgfs_fcst_00.12345-'
+
+# A) Without a collector, the line is appended directly
+$exe $testroot/jlogfile "message A"
+if grep -q "${line_format}message A$" $testroot/jlogfile; then
+  pass=A
+else
+  echo "postmsg (test A) log file '$(cat $testroot/jlogfile)' is not as expected"
+fi
+
+# B) The lines of concurrent writers all reach the log file through the collector
+$ushdir/postmsgd.py > $testroot/postmsgd.log 2>&1 &
+collector=$!
+trap "kill $collector; rm -rf $testroot" EXIT
+for i in $(seq 50); do [ -S $POSTMSGD_SOCKET ] && break; sleep 0.1; done
+writers=""
+for i in $(seq 200); do
+  $exe $testroot/jlogfile "message B$i" &
+  writers="$writers $!"
+done
+wait $writers
+sleep 1
+if [ $(grep -c "${line_format}message B[0-9]*$" $testroot/jlogfile) -eq 200 ] && [ $(wc -l < $testroot/jlogfile) -eq 201 ]; then
+  pass=${pass}B
+else
+  echo "postmsg (test B) log file has '$(wc -l < $testroot/jlogfile)' lines instead of 201"
+fi
+
+# C) The collector is the one writing: it reports a log file it cannot write to
+$exe /proc/postmsg_test/jlogfile "message C"
+sleep 1
+if grep -q "Could not append to /proc/postmsg_test/jlogfile" $testroot/postmsgd.log; then
+  pass=${pass}C
+else
+  echo "postmsg (test C) collector output '$(cat $testroot/postmsgd.log)' is not as expected"
+fi
+
+# D) A line too long for one datagram is appended whole by postmsg itself
+long_message=$(head -c 70000 /dev/zero | tr '\0' x)
+$exe $testroot/jlogfile "$long_message"
+sleep 1
+if grep -q "${line_format}${long_message}$" $testroot/jlogfile; then
+  pass=${pass}D
+else
+  echo "postmsg (test D) log file does not end with the long line"
+fi
+
+# E) The collector reports a datagram longer than it reads instead of taking it whole
+python3 -c "
+import socket
+sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+sock.sendto(b'$testroot/jlogfile\0' + b'y' * 70000, '$POSTMSGD_SOCKET')"
+sleep 1
+if grep -q "A line of 70[0-9]* bytes was cut to 65536" $testroot/postmsgd.log; then
+  pass=${pass}E
+else
+  echo "postmsg (test E) collector output '$(tail -c 500 $testroot/postmsgd.log)' is not as expected"
+fi
+
+# F) Once the collector stops, lines are appended directly again
+kill $collector
+wait $collector
+trap "rm -rf $testroot" EXIT
+$exe $testroot/jlogfile "message F"
+if [ ! -e $POSTMSGD_SOCKET ] && grep -q "${line_format}message F$" $testroot/jlogfile; then
+  pass=${pass}F
+else
+  echo "postmsg (test F) log file '$(tail -1 $testroot/jlogfile)' is not as expected"
+fi
+
+if [ "$pass" != ABCDEF ]; then
+  exit 1
+fi
@@ -0,0 +1,48 @@
+#!/bin/bash
+#
+# This is a test for the NCEPLIBS-prod_util project. This test runs the
+# --range and --batch modes of proddate.py ndate and mdate, and compares
+# them with single calls.
+set -x
+exe=${1:-proddate.py}
+
+# A) A range of forecast hours gives the same dates as a call for each hour
+PRODDATE_REF_A=$(for fhour in $(seq 0 3 384); do $exe ndate $fhour 2026101800; done)
+PRODDATE_TEST_A=$($exe ndate --range 0 384 3 2026101800)
+if [ "$PRODDATE_REF_A" == "$PRODDATE_TEST_A" ] && [ $(echo "$PRODDATE_TEST_A" | wc -l) -eq 129 ]; then
+  pass=A
+else
+  echo "proddate (test A) reference output '$PRODDATE_REF_A' does not match test output '$PRODDATE_TEST_A'"
+fi
+
+# B) A negative step counts back, for hours and minutes
+PRODDATE_REF_B="2023010112 2023010106 2023010100 2022123118 2022123112 202301010030 202301010000 202212312330"
+PRODDATE_TEST_B=$(echo $($exe ndate --range 12 -12 -6 2023010100) $($exe mdate --range 30 -30 -30 202301010000))
+if [ "$PRODDATE_REF_B" == "$PRODDATE_TEST_B" ]; then
+  pass=${pass}B
+else
+  echo "proddate (test B) reference output '$PRODDATE_REF_B' does not match test output '$PRODDATE_TEST_B'"
+fi
+
+# C) A step of zero is an error
+PRODDATE_TEST_C=$($exe ndate --range 0 12 0 2023010100 2>/dev/null)
+status=$?
+if [ $status -eq 1 ] && [ -z "$PRODDATE_TEST_C" ]; then
+  pass=${pass}C
+else
+  echo "proddate (test C) output '$PRODDATE_TEST_C' or exit status $status is not as expected"
+fi
+
+# D) A bad line of a batch gives an empty line, and an exit status of 1
+PRODDATE_REF_D=$(printf '2023010106\n\n2022123118')
+PRODDATE_TEST_D=$(printf '6 2023010100\nbad 2023010100\n-6 2023010100\n' | $exe ndate --batch 2>/dev/null)
+status=$?
+if [ "$PRODDATE_REF_D" == "$PRODDATE_TEST_D" ] && [ $status -eq 1 ]; then
+  pass=${pass}D
+else
+  echo "proddate (test D) reference output '$PRODDATE_REF_D' does not match test output '$PRODDATE_TEST_D' (exit status $status)"
+fi
+
+if [ "$pass" != ABCD ]; then
+  exit 1
+fi
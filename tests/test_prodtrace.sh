@@ -0,0 +1,46 @@
+#!/bin/bash
+#
+# This is a test for the NCEPLIBS-prod_util project. This test runs
+# proddate.py with and without $PRODUTIL_TRACE, and checks the trace
+# records written and the report made from them.
+set -x
+exe=${1:-prodtrace.py}
+ushdir=$(cd $(dirname $(command -v $exe)) && pwd)
+
+testroot=$(mktemp -d)
+trap "rm -rf $testroot" EXIT
+export job=jtest jobid=jtest.12345 DATA=$testroot
+unset PRODUTIL_TRACE
+
+# A) Nothing is traced unless PRODUTIL_TRACE is set
+$ushdir/proddate.py ndate 6 2024010100
+if [ -z "$(ls $testroot)" ]; then
+  pass=A
+else
+  echo "prodtrace (test A) files '$(ls $testroot)' were written with tracing off"
+fi
+
+# B) PRODUTIL_TRACE=directory gives one record per call in the job's file
+for fhour in 0 6 12; do
+  PRODUTIL_TRACE=$testroot/traces $ushdir/proddate.py ndate $fhour 2024010100
+done
+PRODUTIL_TRACE=$testroot/traces $ushdir/proddate.py ndate 6 bad
+trace_file=$testroot/traces/jtest.jtest.12345.jsonl
+if [ $(wc -l < $trace_file) -eq 4 ] && grep -q '"utility":"proddate","operation":"ndate","stage":"single"' $trace_file; then
+  pass=${pass}B
+else
+  echo "prodtrace (test B) trace file '$(cat $trace_file)' is not as expected"
+fi
+
+# C) The report counts the calls and errors of each operation
+PRODTRACE_REF_C="proddate ndate 4 1 1"
+PRODTRACE_TEST_C=$($exe report $testroot/traces | awk 'NR == 2 {print $1, $2, $3, $4, $5}')
+if [ "$PRODTRACE_REF_C" == "$PRODTRACE_TEST_C" ]; then
+  pass=${pass}C
+else
+  echo "prodtrace (test C) reference output '$PRODTRACE_REF_C' does not match test output '$PRODTRACE_TEST_C'"
+fi
+
+if [ "$pass" != ABC ]; then
+  exit 1
+fi
@@ -4,12 +4,22 @@
 #          path. For COMIN paths, a search is performed in the following order:
 #              1. the COMPATH variable in an envir-insensitive manner
 #              2. the COM path list in an envir-sensitive manner
-#              3. the production paths - success if only one match is found
+#              3. the production paths - success if only one match is found, or with
+#                 '-f' the first one found.  The paths are checked in parallel, giving up
+#                 on any that take longer than $COMPATH_PROBE_TIMEOUT seconds (default 5),
+#                 and the results are cached for $COMPATH_PROBE_TTL seconds (default 60) in
+#                 $COMPATH_PROBE_CACHE (default /tmp/compath_probe.<uid>.json; set it to an
+#                 empty string to disable the cache).  A path that timed out is skipped
+#                 for $COMPATH_PROBE_RETRY seconds (default 15) before it is checked again.
 #          For COMOUT directories ('-o' flag), the COMROOT variable is prepended to the
 #          provided relative COM path.
-# Usage:   compath [-o] [-e envir] [-v] relpath
+# Usage:   compath [-o] [-e envir] [-f] [-v] relpath
 #              where relpath may contain $NET/$ver, $NET/$ver/$envir, $NET/$ver/$envir/$RUN, or
 #              $NET/$ver/$envir/$RUN.$PDY.
+#          compath [-o] [-e envir] [-f] [-v] --batch [file]
+#              resolves one relpath per line of file (or stdin), each optionally preceded by
+#              its own -o and -e options, and prints "relpath<TAB>abspath" for each line, or
+#              "relpath<TAB>ERROR: message" if it could not be resolved.
 # Input:   /lfs/h1/ops/${envir}/config/compaths.list files, where $envir is retrieved from one of the
 #          following (in order of decreasing precedence):
 #              1. the command line '-e' or '--envir' switch
@@ -17,11 +27,27 @@
 #                 test/config/comroot.list file)
 #              3. the $envir environment variable
 #              4. "prod"
+#          An index of each compaths.list file is cached next to it in compaths.list.index
+#          and is rebuilt automatically whenever the list's modification time or size changes.
+#          The index file can only be written by users who may write to the list's directory
+#          (normally the ops accounts); until one of them has written it, other users build
+#          the index again in every process, without the speedup.
+# Trace:   When $PRODUTIL_TRACE is set, the time and stage (COMROOT, COMPATH, list, probe,
+#          or memo for a result remembered by the process) of each lookup are written to
+#          the job's trace file (see prodtrace.py).
+# Python:  Long-running Python programs should use a CompathResolver object, which takes
+#          its own COM aliases and list location, memoizes results, and raises
+#          CompathError instead of exiting.
 
-from os import path, environ, getenv, system
-from sys import exit, stderr
-import re
-from functools import partial
+from os import path, environ, getenv, getuid, system
+from sys import exit, stderr, stdin
+import os, re, json, shlex, tempfile, threading, time
+from collections import OrderedDict
+from functools import partial, lru_cache
+from prodtrace import trace
+
+class CompathError(Exception):
+    """!Raised when a COM path cannot be resolved."""
 
 def err_exit(msg):
 #    if __name__ == "__main__":
@@ -30,29 +56,51 @@ def err_exit(msg):
     print(msg, file=stderr)
     exit(1)
 
-if path.exists('/lfs/h1'):
-    com_aliases = { # use "<envir>" to include environment in path
-        '/comh1': '/lfs/h1/ops/<envir>/com',
-        '/comh2': '/lfs/h2/ops/<envir>/com',
-    }
-else:
-    err_exit('Unable to find /lfs/h1. Are you on WCOSS?')
+# Default COM aliases on WCOSS2; use "<envir>" to include environment in path
+com_aliases = {
+    '/comh1': '/lfs/h1/ops/<envir>/com',
+    '/comh2': '/lfs/h2/ops/<envir>/com',
+}
+
+# Default location of the COM path list of each environment
+compaths_list_template = '/lfs/h1/ops/<envir>/config/compaths.list'
 
 # STRUCTURE: <envir>/<com>/<NET>/<version>/<RUN><...>
 # NET and version are required
-parse_compath = re.compile(r'(?P<envir>prod|para|test|canned)?/?(com/)?(?P<NET>[\w-]+)/(?P<version>v\d+\.\d+[^/]*)((?:/(?P<RUN>[\w-]+?)(?:\.(?P<PDY>2\d(?:\d\d){1,4}))?)?)?$')
-parse_compath_var = re.compile(r'(/lfs/[hf][0-9]/ops/)?(?P<envir>prod|para|test|canned)?/?(com/)?(?P<NET>[\w-]+)(/?P<version>v\d+\.\d+[^/]*)?((?:/(?P<RUN>[\w-]+?)(?:\.(?P<PDY>2\d(?:\d\d){1,4}))?)?)?$')
+_patterns = {
+    'compath': r'(?P<envir>prod|para|test|canned)?/?(com/)?(?P<NET>[\w-]+)/(?P<version>v\d+\.\d+[^/]*)((?:/(?P<RUN>[\w-]+?)(?:\.(?P<PDY>2\d(?:\d\d){1,4}))?)?)?$',
+    'compath_var': r'(/lfs/[hf][0-9]/ops/)?(?P<envir>prod|para|test|canned)?/?(com/)?(?P<NET>[\w-]+)(/?P<version>v\d+\.\d+[^/]*)?((?:/(?P<RUN>[\w-]+?)(?:\.(?P<PDY>2\d(?:\d\d){1,4}))?)?)?$',
+    'relpath': r'(?P<envir>prod|para|test|canned)?/?(?:com/)?(?P<NET>[\w-]+)/(?P<version>v\d+\.\d+[^/]*)((?:/(?P<RUN>[\w-]+?)(?:\.(?P<PDY>2\d(?:\d\d){1,4}))?)?(?P<tail>/.+)?)?$',
+    'version': r'(/v\d+\.\d+)[\d\.]*',
+}
+
+# Function that compiles the named pattern the first time it is needed
+@lru_cache(maxsize=None)
+def get_pattern(name):
+    return re.compile(_patterns[name])
+
+# Compile parse_compath and parse_compath_var only when they are first accessed
+def __getattr__(name):
+    if name == 'parse_compath':
+        return get_pattern('compath')
+    if name == 'parse_compath_var':
+        return get_pattern('compath_var')
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
 
 # Function that returns a dictionary containing the NET, envir, RUN, and PDY parts of dirpath
-def getparts(dirpath, iscompathvar=False):
-    if iscompathvar: match_result = parse_compath_var.search(dirpath)
-    else: match_result = parse_compath.search(dirpath)
+# and passes the warning for a malformed one to warn (default: print it to stderr)
+def getparts(dirpath, iscompathvar=False, warn=None):
+    if iscompathvar: match_result = get_pattern('compath_var').search(dirpath)
+    else: match_result = get_pattern('compath').search(dirpath)
     if match_result:
         dirdict = match_result.groupdict()
         dirdict['path'] = dirpath
         return dirdict
     else:
-        print("WARNING: A member of the COM path list (" + dirpath + ") is not formatted correctly", file=stderr)
+        if warn is None:
+            print(malformed_warning(dirpath), file=stderr)
+        else:
+            warn(malformed_warning(dirpath))
         return {'path': dirpath}
 
 # Function to search for a path in a list of paths.  First, the full length will
@@ -96,9 +144,560 @@ def findpath(relpath_parts, dirlist_parts, envir_sensitive=True):
                     match_pathparts.append(relpath_parts['tail'])
                 return ''.join(match_pathparts)
 
-def get_compath(relpath, envir=None, out=False, verbose=False):
+# Function that returns the parsed members of the COMPATH variable, with any
+# COM aliases replaced by the directories they stand for
+def get_compath_var_dirlist(compath_var, aliases=None, warn=None):
+    if aliases is None:
+        aliases = com_aliases
+    # Split COMPATH by colons and commas
+    var_dirlist = [ s.strip().rstrip('/') for s in re.split(r':|,', compath_var) ]
+    env = re.findall("/(prod|para|test)/",compath_var)
+    for i in range(len(var_dirlist)):
+        for key in aliases.keys():
+            var_dirlist[i] = re.sub(f"^{key}",aliases[key],var_dirlist[i])
+        if env:
+            var_dirlist[i] = re.sub("/com/(prod|para|test)/","/com/",var_dirlist[i])
+            var_dirlist[i] = re.sub("<envir>",env[0],var_dirlist[i])
+    getparts_func = partial(getparts, iscompathvar=True, warn=warn)
+    return list(map(getparts_func, var_dirlist))
+
+# Version of the compaths.list index cache format; bump when the layout changes
+COMPATHS_INDEX_VERSION = 1
+COMPATHS_INDEX_SUFFIX = '.index'
+
+# Function that builds an index of the compaths.list file.  The index maps the
+# (NET, version, RUN, PDY) parts of each entry, joined by tabs, to the first
+# path in the file with exactly those parts defined.
+def build_compaths_index(compaths_list):
+    index = dict()
+    malformed = list()
+    for line in compaths_list:
+        if not line or line.startswith('#'):
+            continue
+        dirpath = line.strip().rstrip('/')
+        match_result = get_pattern('compath').search(dirpath)
+        if not match_result:
+            malformed.append(dirpath)
+            continue
+        dir_parts = match_result.groupdict()
+        key = []
+        for part_name in ('NET', 'version', 'RUN', 'PDY'):
+            if not dir_parts[part_name]:
+                break
+            key.append(dir_parts[part_name])
+        index.setdefault('\t'.join(key), dirpath)
+    return index, malformed
+
+# Function that returns the index of a compaths.list file and its malformed
+# entries.  The index is cached in a file next to the list and is rebuilt whenever
+# the list's mtime or size changes.  If the cache cannot be written, the index is
+# only kept for this call.
+def read_compaths_index(compaths_filename):
+    cache_filename = compaths_filename + COMPATHS_INDEX_SUFFIX
+    with open(compaths_filename, 'r') as compaths_list:
+        list_stat = os.fstat(compaths_list.fileno())
+        stamp = [list_stat.st_mtime_ns, list_stat.st_size]
+        try:
+            with open(cache_filename, 'r') as cache_file:
+                cache = json.load(cache_file)
+            if (cache.get('version') == COMPATHS_INDEX_VERSION and cache.get('stamp') == stamp and
+                    isinstance(cache.get('index'), dict) and isinstance(cache.get('malformed'), list)):
+                index, malformed = cache['index'], cache['malformed']
+            else:
+                cache = None
+        except (IOError, ValueError, KeyError, AttributeError):
+            cache = None
+        if cache is None:
+            index, malformed = build_compaths_index(compaths_list)
+            try:
+                fd, tmp_filename = tempfile.mkstemp(prefix=path.basename(cache_filename) + '.',
+                                                    dir=path.dirname(cache_filename) or '.')
+                try:
+                    with os.fdopen(fd, 'w') as cache_file:
+                        json.dump({'version': COMPATHS_INDEX_VERSION, 'stamp': stamp,
+                                   'index': index, 'malformed': malformed}, cache_file)
+                    os.chmod(tmp_filename, 0o644)
+                    os.replace(tmp_filename, cache_filename)
+                except:
+                    os.unlink(tmp_filename)
+                    raise
+            except (IOError, OSError):
+                pass
+    return index, malformed
+
+# Function that returns the warning for a malformed entry of a COM path list
+def malformed_warning(dirpath):
+    return "WARNING: A member of the COM path list (" + dirpath + ") is not formatted correctly"
+
+# Function that returns the index of a compaths.list file, printing its malformed entries
+def load_compaths_index(compaths_filename):
+    index, malformed = read_compaths_index(compaths_filename)
+    for dirpath in malformed:
+        print(malformed_warning(dirpath), file=stderr)
+    return index
+
+# Function to search for a path in a compaths.list index.  This gives the same
+# result as findpath with the parsed list: the longest prefix of the relpath's
+# NET, version, RUN and PDY parts that is a key of the index wins.
+def findpath_indexed(relpath_parts, index):
+    pathpart_names = ('NET', 'version', 'RUN', 'PDY')
+    key = []
+    for part_name in pathpart_names:
+        if not relpath_parts[part_name]:
+            break
+        key.append(relpath_parts[part_name])
+
+    for num_pathparts in range(len(key), 0, -1):
+        dirpath = index.get('\t'.join(key[:num_pathparts]))
+        if dirpath is not None:
+            match_pathparts = [ dirpath ]
+            for part, value in zip(pathpart_names[num_pathparts:], key[num_pathparts:]):
+                match_pathparts.append('.' if part == 'PDY' else '/')
+                match_pathparts.append(value)
+            if relpath_parts['tail']:
+                match_pathparts.append(relpath_parts['tail'])
+            return ''.join(match_pathparts)
+
+class PathProber(object):
+    """!Checks whether paths exist, all at the same time, in daemon threads so
+    that a hung filesystem cannot keep the process from exiting.  A path that
+    is still being checked, even for a caller that has given up waiting, is
+    not checked again: later callers wait for the same check, so a hung
+    filesystem ties up one thread per path rather than one per lookup.
+
+    @param late: Function called with a path and whether it exists when its
+                 check finishes after every caller has stopped waiting.
+    """
+
+    def __init__(self, late=None):
+        self.late = late
+        self._finished = threading.Condition()
+        self._checks = dict()
+
+    def probe(self, paths, timeout, first_hit=False):
+        """!Returns a dictionary of the paths that were checked within the
+        timeout and whether they exist.  With first_hit, returns as soon as
+        one path is found.
+        """
+        with self._finished:
+            checks = dict()
+            for fullpath in paths:
+                check = self._checks.get(fullpath)
+                if check is None:
+                    check = self._checks[fullpath] = dict(exists=None, finished=False, waiters=0)
+                    threading.Thread(target=self._check, args=(fullpath, check), daemon=True).start()
+                check['waiters'] += 1
+                checks[fullpath] = check
+            deadline = time.monotonic() + timeout
+            try:
+                while True:
+                    results = dict((p, c['exists']) for p, c in checks.items() if c['finished'])
+                    if len(results) == len(checks) or (first_hit and any(results.values())):
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._finished.wait(remaining)
+            finally:
+                for check in checks.values():
+                    check['waiters'] -= 1
+            return results
+
+    def _check(self, fullpath, check):
+        exists = path.exists(fullpath)
+        with self._finished:
+            check['exists'], check['finished'] = exists, True
+            del self._checks[fullpath]
+            late = check['waiters'] == 0
+            self._finished.notify_all()
+        if late and self.late:
+            self.late(fullpath, exists)
+
+# Function that checks whether each of the paths exists, all at the same time.
+# Returns a dictionary of the paths that were checked within the timeout and
+# whether they exist.  With first_hit, it returns as soon as one path is found.
+def probe_paths(paths, timeout, first_hit=False):
+    return PathProber().probe(paths, timeout, first_hit)
+
+class ProbeCache(object):
+    """!Cache of whether COM paths exist, shared by every process that uses
+    the same file.  Entries expire after ttl seconds.  A check that timed out
+    is recorded too, with None for whether the path exists, and expires after
+    retry seconds.  A file that belongs to another user, or that others may
+    write to, is ignored.
+
+    @param filename: JSON file holding the cache, or None to only keep the
+                     cache in memory.
+    @param ttl:      Seconds for which a result is trusted.
+    @param retry:    Seconds for which a timeout is remembered (default: ttl).
+    """
+
+    def __init__(self, filename, ttl, retry=None):
+        self.filename = filename
+        self.ttl = ttl
+        self.retry = ttl if retry is None else retry
+        self._entries = None
+
+    def _read(self):
+        try:
+            with open(self.filename, 'r') as cache_file:
+                # Another user could plant false results in a shared directory such as /tmp
+                cache_stat = os.fstat(cache_file.fileno())
+                if cache_stat.st_uid != getuid() or cache_stat.st_mode & 0o022:
+                    return dict()
+                entries = json.load(cache_file)
+            if isinstance(entries, dict):
+                return dict((p, e) for p, e in entries.items() if isinstance(e, list) and len(e) == 2
+                            and (e[0] is None or isinstance(e[0], bool)) and isinstance(e[1], (int, float)))
+        except (IOError, ValueError, TypeError):
+            pass
+        return dict()
+
+    def _entry(self, fullpath):
+        # Returns the entry of fullpath if it has not expired
+        if self._entries is None:
+            self._entries = self._read() if self.filename else dict()
+        entry = self._entries.get(fullpath)
+        if entry and time.time() - entry[1] < (self.ttl if entry[0] is not None else self.retry):
+            return entry
+        return None
+
+    def get(self, fullpath):
+        """!Returns whether fullpath exists, or None if that is not known."""
+        entry = self._entry(fullpath)
+        return entry[0] if entry else None
+
+    def timed_out(self, fullpath):
+        """!Returns whether checking fullpath recently timed out."""
+        entry = self._entry(fullpath)
+        return entry is not None and entry[0] is None
+
+    def update(self, results):
+        """!Records whether each path in the results dictionary exists, or
+        that checking it timed out for a value of None.
+        """
+        if not results:
+            return
+        now = time.time()
+        # Merge with the entries written by other processes since the file was read
+        entries = self._read() if self.filename else dict()
+        if self._entries:
+            entries.update((p, e) for p, e in self._entries.items() if p not in entries)
+        entries = dict((p, e) for p, e in entries.items() if now - e[1] < max(self.ttl, self.retry))
+        entries.update((p, [exists, now]) for p, exists in results.items())
+        self._entries = entries
+        if not self.filename:
+            return
+        try:
+            fd, tmp_filename = tempfile.mkstemp(prefix=path.basename(self.filename) + '.',
+                                                dir=path.dirname(self.filename) or '.')
+            try:
+                with os.fdopen(fd, 'w') as cache_file:
+                    json.dump(entries, cache_file)
+                os.replace(tmp_filename, self.filename)
+            except:
+                os.unlink(tmp_filename)
+                raise
+        except (IOError, OSError):
+            pass
+
+def default_probe_cache():
+    return getenv('COMPATH_PROBE_CACHE', '/tmp/compath_probe.%d.json' % getuid()) or None
+
+class CompathResolver(object):
+    """!Resolves relative COM paths to absolute paths in the same way as the
+    compath command, but without exiting or touching the filesystem until a
+    path is requested.  Results are kept in an LRU cache keyed on the relpath,
+    the options and the environment variables that affect the answer; cached
+    results found in a compaths.list file are dropped when that file changes.
+    Results found by searching the COM directories are not cached.
+
+    @param aliases:        Dictionary of COM aliases (e.g. '/comh1') and the
+                           directories they stand for, which may contain
+                           "<envir>" (default: com_aliases).
+    @param roots:          COM directories to search when the path is not in
+                           $COMPATH or the list (default: the alias targets).
+    @param compaths_list:  Location of the COM path list, where "<envir>" is
+                           replaced by the environment.
+    @param cache_size:     Maximum number of results to keep.
+    @param check_interval: Seconds between checks of a list file's mtime and
+                           size.
+    @param environ:        Mapping to read $COMPATH, $COMROOT and $envir from
+                           (default: os.environ).
+    @param probe_timeout:  Seconds to wait for the COM directories to be
+                           checked (default: $COMPATH_PROBE_TIMEOUT, or 5).
+    @param probe_ttl:      Seconds for which the result of checking a COM
+                           directory is cached (default: $COMPATH_PROBE_TTL,
+                           or 60).
+    @param probe_cache:    File in which to share those results with other
+                           processes, or '' to keep them in memory (default:
+                           $COMPATH_PROBE_CACHE, or
+                           /tmp/compath_probe.<uid>.json).
+    @param probe_retry:    Seconds before a COM directory whose check timed
+                           out is checked again; until then it is skipped
+                           with the same warning (default: $COMPATH_PROBE_RETRY,
+                           or 15).
+    """
+
+    def __init__(self, aliases=None, roots=None, compaths_list=compaths_list_template,
+                 cache_size=1024, check_interval=1.0, environ=None,
+                 probe_timeout=None, probe_ttl=None, probe_cache=None, probe_retry=None):
+        self.aliases = dict(com_aliases if aliases is None else aliases)
+        self.roots = list(dict.fromkeys(self.aliases.values() if roots is None else roots))
+        self.compaths_list = compaths_list
+        self.cache_size = cache_size
+        self.check_interval = check_interval
+        self.environ = os.environ if environ is None else environ
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+        self._compath_vars = dict()
+        self._indexes = dict()
+        self._stamps = dict()
+        self._alias_pattern = None
+        self.probe_timeout = float(getenv('COMPATH_PROBE_TIMEOUT', 5) if probe_timeout is None else probe_timeout)
+        probe_ttl = float(getenv('COMPATH_PROBE_TTL', 60) if probe_ttl is None else probe_ttl)
+        probe_retry = float(getenv('COMPATH_PROBE_RETRY', 15) if probe_retry is None else probe_retry)
+        self._probe_cache = ProbeCache(default_probe_cache() if probe_cache is None else probe_cache or None,
+                                       probe_ttl, probe_retry)
+        self._prober = PathProber(late=self._probed_late)
+
+    def clear(self):
+        """!Forgets all cached results, lists and COMPATH values."""
+        with self._lock:
+            self._results.clear()
+            self._compath_vars.clear()
+            self._indexes.clear()
+            self._stamps.clear()
+
+    def preload(self, envirs=('prod', 'para', 'test', 'canned')):
+        """!Reads the compaths.list of each environment that has changed since
+        it was last read, so that later lookups do not have to.
+
+        @param envirs: Environments whose lists should be read.
+        """
+        for envir in envirs:
+            try:
+                self._get_index(self.compaths_list.replace("<envir>",envir))
+            except IOError:
+                pass
+
+    def resolve(self, relpath, envir=None, out=False, verbose=False, environ=None, first_hit=False):
+        """!Returns the absolute path of the production COM directory
+        represented by the provided relative path.
+
+        @param relpath: The relative path of the COM directory desired.
+        @param envir:   Environment of the COM paths list to use (default:
+                        $envir environment variable).
+        @param out:     Whether to return the location for a COMOUT (out=True)
+                        or COMIN (out=False) directory.
+        @param verbose: Whether to print the source of the returned path to
+                        stderr.
+        @param environ: Mapping to read environment variables from for this
+                        lookup (default: the resolver's environ).
+        @param first_hit: Whether a search of the COM directories may return
+                        the first match found instead of requiring exactly one.
+        @returns        A string containing the absolute path of the desired
+                        production COM directory.
+        @raises CompathError if the path is malformed or cannot be found.
+        """
+        foundpath, source = self.resolve_with_source(relpath, envir, out, environ, first_hit)
+        if verbose:
+            print(source, file=stderr)
+        return foundpath
+
+    def resolve_with_source(self, relpath, envir=None, out=False, environ=None, first_hit=False, warn=None):
+        """!Same as resolve, but instead of printing the source of the path,
+        returns it with the path.
+
+        @param warn: Function called with each warning about the lookup, such
+                     as a malformed entry in the list or a COM directory that
+                     timed out (default: print it to stderr).  A server uses
+                     it to send the warnings to its client.
+        @returns A tuple of the absolute path and a message describing where it
+                 was found.
+        """
+        if environ is None:
+            environ = self.environ
+        if warn is None:
+            warn = partial(print, file=stderr)
+        key = (relpath, envir, bool(out), environ.get('COMPATH'), environ.get('COMROOT'), environ.get('envir'))
+        with trace('compath', 'resolve', relpath=relpath, out=bool(out)) as record:
+            with self._lock:
+                result = self._results.get(key)
+                if result is not None:
+                    self._results.move_to_end(key)
+            if result is not None and result[2] is not None and self._list_stamp(result[2][0]) != result[2][1]:
+                result = None
+            if result is None:
+                warnings = list()
+                try:
+                    result = self._resolve(relpath, envir, out, environ, first_hit, warnings)
+                finally:
+                    for message in warnings:
+                        warn(message)
+                record['stage'] = result[4]
+                if result[3]:
+                    with self._lock:
+                        self._results[key] = result
+                        while len(self._results) > self.cache_size:
+                            self._results.popitem(last=False)
+            else:
+                # Give the warnings of the lookup again, as compath.py would
+                for message in result[5]:
+                    warn(message)
+                record['stage'] = 'memo'
+        return result[0], result[1]
+
+    def _list_stamp(self, compaths_filename):
+        # Returns the mtime and size of a list file, checking at most once per check_interval
+        now = time.monotonic()
+        checked = self._stamps.get(compaths_filename)
+        if checked is None or now - checked[0] >= self.check_interval:
+            try:
+                list_stat = os.stat(compaths_filename)
+                stamp = (list_stat.st_mtime_ns, list_stat.st_size)
+            except OSError:
+                stamp = None
+            checked = (now, stamp)
+            self._stamps[compaths_filename] = checked
+        return checked[1]
+
+    def _get_index(self, compaths_filename):
+        stamp = self._list_stamp(compaths_filename)
+        loaded = self._indexes.get(compaths_filename)
+        if stamp is None or loaded is None or loaded[0] != stamp:
+            loaded = (stamp,) + read_compaths_index(compaths_filename)
+            self._indexes[compaths_filename] = loaded
+        return loaded
+
+    def _get_compath_var_dirlist(self, compath_var, warnings):
+        if compath_var not in self._compath_vars:
+            malformed = list()
+            dirlist = get_compath_var_dirlist(compath_var, self.aliases, malformed.append)
+            self._compath_vars[compath_var] = (dirlist, malformed)
+        dirlist, malformed = self._compath_vars[compath_var]
+        warnings.extend(malformed)
+        # findpath modifies the list it is given, so pass it a copy
+        return [ dict(dir_parts) for dir_parts in dirlist ]
+
+    def _search_roots(self, relpath, envir, first_hit, warnings):
+        candidates = [ root.replace("<envir>",envir) + '/' + relpath for root in self.roots ]
+        with self._lock:
+            cached = dict((fullpath, self._probe_cache.get(fullpath)) for fullpath in candidates)
+            # Paths that timed out recently are not waited for again until the retry delay has passed
+            slow = [ fullpath for fullpath in candidates if self._probe_cache.timed_out(fullpath) ]
+        if first_hit and any(cached.values()):
+            return [ fullpath for fullpath in candidates if cached[fullpath] ][:1]
+        unknown = [ fullpath for fullpath in candidates if cached[fullpath] is None and fullpath not in slow ]
+        if unknown:
+            probed = self._prober.probe(unknown, self.probe_timeout, first_hit)
+            cached.update(probed)
+            if not (first_hit and any(probed.values())):
+                timed_out = [ fullpath for fullpath in unknown if fullpath not in probed ]
+                slow += timed_out
+                probed.update((fullpath, None) for fullpath in timed_out)
+            with self._lock:
+                self._probe_cache.update(probed)
+        if not (first_hit and any(cached.values())):
+            for fullpath in candidates:
+                if fullpath in slow:
+                    warnings.append("WARNING: Timed out checking whether " + fullpath + " exists")
+        possible_paths = [ fullpath for fullpath in candidates if cached[fullpath] ]
+        return possible_paths[:1] if first_hit else possible_paths
+
+    def _probed_late(self, fullpath, exists):
+        # Records the result of a check that finished after the lookups gave up on it
+        with self._lock:
+            self._probe_cache.update({fullpath: exists})
+
+    def _resolve(self, relpath, envir, out, environ, first_hit, warnings):
+        # Returns the path found, the message describing where it was found, the
+        # list file and stamp it depends on, whether it may be cached, the stage
+        # that found it (COMROOT, COMPATH, list or probe) and the warnings given,
+        # which are also added to warnings
+        envir_given = envir is not None
+
+        relpath = get_pattern('version').sub(r"\1",relpath) # chop version number down to first 2 digits
+
+        match_result = get_pattern('relpath').match(relpath)
+        if match_result:
+            relpath_parts = match_result.groupdict()
+            if envir == None:
+                envir = relpath_parts['envir'] if relpath_parts['envir'] else environ.get('envir', 'prod')
+        else:
+            raise CompathError('The relative COM path provided (' + relpath + ') is not formatted correctly.')
+
+        foundpath = None
+        source = None
+        stage = None
+        depends = None
+        cacheable = True
+
+        # If we are looking for a COMOUT path, use the COMROOT variable
+        if out:
+            try:
+                foundpath = environ['COMROOT'] + '/' + relpath
+                source = "COMOUT path found using $COMROOT environment variable"
+                stage = 'COMROOT'
+            except KeyError:
+                raise CompathError('$COMROOT is not defined. Please define it or load the prod_envir module.')
+
+        # Search the COMPATH environment variable for an appropriate match
+        # The matching done in this case is envir-insensitive, meaning that a relpath
+        # will match with directories in the dirlist from a different environment
+        if not foundpath:
+            compath_var = environ.get('COMPATH')
+            if compath_var:
+                var_dirlist_parts = self._get_compath_var_dirlist(compath_var, warnings)
+                foundpath = findpath(relpath_parts, var_dirlist_parts, envir_sensitive=False)
+                if foundpath:
+                    source = "COMIN path found in $COMPATH environment variable"
+                    stage = 'COMPATH'
+
+        # Search the compaths list file for an appropriate match
+        if not foundpath:
+            compaths_filename = self.compaths_list.replace("<envir>",envir)
+            try:
+                stamp, compaths_index, malformed = self._get_index(compaths_filename)
+                warnings.extend(malformed_warning(dirpath) for dirpath in malformed)
+                foundpath = findpath_indexed(relpath_parts, compaths_index)
+                if foundpath:
+                    source = "COMIN path found in " + compaths_filename
+                    stage = 'list'
+                    depends = (compaths_filename, stamp)
+            except IOError as err:
+                warnings.append("WARNING: Could not find the " + envir + " COM paths list at " + str(err.filename))
+
+        # Search the available COM directories.  If only one path is found, return it.
+        if not foundpath:
+            if relpath_parts['envir'] and not envir_given:
+                relpath = re.sub(f"^{envir}/(com/)?","",relpath)
+            possible_paths = self._search_roots(relpath, envir, first_hit, warnings)
+            if len(possible_paths) == 1:
+                foundpath = possible_paths[0]
+                source = "COMIN path found searching through the system COM paths"
+                stage = 'probe'
+                cacheable = False
+
+        if foundpath:
+            return self._expand_aliases(foundpath, envir), source, depends, cacheable, stage, list(warnings)
+        else:
+            raise CompathError('Could not find ' + relpath)
+
+    def _expand_aliases(self, foundpath, envir):
+        # Replace the matching alias (if an alias was used in the found path)
+        # with its corresponding full path
+        if self.aliases:
+            if self._alias_pattern is None:
+                self._alias_pattern = re.compile("^(?:%s)(?=/)" % '|'.join(map(re.escape, self.aliases.keys())))
+            foundpath = self._alias_pattern.sub(lambda x: self.aliases[x.group()], foundpath, 1)
+        return foundpath.replace("<envir>",envir)
+
+_default_resolver = None
+
+def get_compath(relpath, envir=None, out=False, verbose=False, first_hit=False):
     """!Returns the absolute path of the production COM directory represented
-    by the provided relative path.
+    by the provided relative path, using a resolver shared by the process.
 
     @param relpath: The relative path of the COM directory desired.
     @param envir:   Environment of the COM paths list to use (default: $envir
@@ -108,93 +707,69 @@ def get_compath(relpath, envir=None, out=False, verbose=False):
                     COMOUT directories will always point to the current system.
     @param verbose: Whether to print the source of the returned COMROOT path to
                     stderr.
+    @param first_hit: Whether a search of the COM directories may return the
+                    first match found instead of requiring exactly one.
     @returns        A string containing the absolute path of the desired
                     production COM directory.
+    @raises CompathError if the path is malformed or cannot be found.
     """
+    global _default_resolver
+    if _default_resolver is None:
+        _default_resolver = CompathResolver()
+    return _default_resolver.resolve(relpath, envir, out, verbose, first_hit=first_hit)
 
-    relpath = re.sub("(/v\d+\.\d+)[\d\.]*",r"\1",relpath) # chop version number down to first 2 digits
-
-    match_result = re.match(r'(?P<envir>prod|para|test|canned)?/?(?:com/)?(?P<NET>[\w-]+)/(?P<version>v\d+\.\d+[^/]*)((?:/(?P<RUN>[\w-]+?)(?:\.(?P<PDY>2\d(?:\d\d){1,4}))?)?(?P<tail>/.+)?)?$', relpath)
-    if match_result:
-        relpath_parts = match_result.groupdict()
-        if envir == None:
-            envir = relpath_parts['envir'] if relpath_parts['envir'] else getenv('envir', 'prod')
-    else:
-        err_exit('The relative COM path provided (' + relpath + ') is not formatted correctly.')
-
-    foundpath = None
-
-    # If we are looking for a COMOUT path, use the COMROOT variable
-    if out:
-        try:
-            foundpath = environ['COMROOT'] + '/' + relpath
-            if verbose and foundpath:
-                print("COMOUT path found using $COMROOT environment variable", file=stderr)
-        except KeyError:
-            err_exit('$COMROOT is not defined. Please define it or load the prod_envir module.')
-
-    # Search the COMPATH environment variable for an appropriate match
-    # The matching done in this case is envir-insensitive, meaning that a relpath
-    # will match with directories in the dirlist from a different environment
-    if not foundpath:
-        compath_var = getenv('COMPATH')
-        if compath_var:
-            # Split COMPATH by colons and commas
-            var_dirlist = [ s.strip().rstrip('/') for s in re.split(r':|,', compath_var) ]
-            for i in range(len(var_dirlist)):
-                for key in com_aliases.keys():
-                    var_dirlist[i] = re.sub(f"^{key}",com_aliases[key],var_dirlist[i])
-                env = re.findall("/(prod|para|test)/",compath_var)
-                if env:
-                    var_dirlist[i] = re.sub("/com/(prod|para|test)/","/com/",var_dirlist[i])
-                    var_dirlist[i] = re.sub("<envir>",env[0],var_dirlist[i])
-            getparts_func = partial(getparts, iscompathvar=True)
-            var_dirlist_parts = list(map(getparts_func, var_dirlist))
-            foundpath = findpath(relpath_parts, var_dirlist_parts, envir_sensitive=False)
-            if verbose and foundpath:
-                print("COMIN path found in $COMPATH environment variable", file=stderr)
+# Function to parse one line of a batch file into the relpath and the
+# options given for it, starting from the command-line defaults
+def parse_batch_line(line, envir=None, out=False):
+    tokens = shlex.split(line, comments=True)
+    relpath = None
+    while tokens:
+        token = tokens.pop(0)
+        if token in ('-o', '--out'):
+            out = True
+        elif token in ('-e', '--envir') or token.startswith('--envir='):
+            if '=' in token:
+                envir = token.split('=', 1)[1]
+            elif tokens:
+                envir = tokens.pop(0)
+            else:
+                raise CompathError(token + ' requires an argument')
+            if envir not in ('prod', 'para', 'test', 'canned'):
+                raise CompathError('Invalid envir ' + envir)
+        elif token.startswith('-'):
+            raise CompathError('Unrecognized option ' + token)
+        elif relpath is None:
+            relpath = token
         else:
-            foundpath = None
+            raise CompathError('Only one relpath may be given per line')
+    return relpath, envir, out
 
-    # Search the compaths list file for an appropriate match
-    if not foundpath:
-        compaths_filename = "/lfs/h1/ops/%s/config/compaths.list"%envir
+def run_batch(batch_file, envir=None, out=False, verbose=False, first_hit=False):
+    """!Resolves every relpath in batch_file and writes one line per relpath to
+    stdout.  Failed lookups are reported on their own line and do not stop the
+    batch.
+
+    @param batch_file: Open file containing one relpath per line, each
+                       optionally preceded by -o and/or -e envir.
+    @param envir:      Default environment for lines without -e.
+    @param out:        Whether lines without -o are COMOUT directories.
+    @param verbose:    Whether to print the source of each path to stderr.
+    @param first_hit:  Whether searches of the COM directories may return the
+                       first match found.
+    @returns           The number of lines that could not be resolved.
+    """
+    failures = 0
+    for line in batch_file:
+        relpath = line.strip()
         try:
-            with open(compaths_filename, 'r') as compaths_list:
-                file_dirlist = [line.strip().rstrip('/') for line in compaths_list if line and not line.startswith('#')]
-            file_dirlist_parts = list(map(getparts, file_dirlist))
-            foundpath = findpath(relpath_parts, file_dirlist_parts)
-            if verbose and foundpath:
-                print("COMIN path found in", compaths_filename, file=stderr)
-        except IOError as err:
-            print("WARNING: Could not find the", envir, "COM paths list at", err.filename, file=stderr)
-
-    # Search the available COM directories.  If only one path is found, return it.
-    if not foundpath:
-        possible_paths = list()
-        pathenvir = getparts(relpath)["envir"]
-        if args.envir is None:
-            envir = pathenvir
-            relpath = re.sub(f"^{envir}/(com/)?","",relpath)
-        for dir in set(com_aliases.values()):
-            try: dir = dir.replace("<envir>",envir)
-            except: pass
-            fullpath = dir + '/' + relpath
-            if path.exists(fullpath): possible_paths.append(fullpath)
-        if len(possible_paths) == 1:
-            foundpath = possible_paths[0]
-            if verbose and foundpath:
-                print("COMIN path found searching through the system COM paths", file=stderr)
-    if foundpath:
-        # Replace the matching alias (if an alias was used in the found path) in
-        # com_aliases with its corresponding full path
-        pattern = re.compile("^(?:%s)(?=/)" % '|'.join(map(re.escape, com_aliases.keys())))
-        foundpath = pattern.sub(lambda x: com_aliases[x.group()], foundpath, 1)
-
-        # Print the absolute COM path
-        return foundpath.replace("<envir>",envir)
-    else:
-        err_exit('Could not find ' + relpath)
+            relpath, line_envir, line_out = parse_batch_line(line, envir, out)
+            if relpath is None:
+                continue
+            print(relpath, get_compath(relpath, line_envir, line_out, verbose, first_hit), sep='\t', flush=True)
+        except (CompathError, ValueError) as err:
+            failures += 1
+            print(relpath, 'ERROR: ' + str(err), sep='\t', flush=True)
+    return failures
 
 if __name__ == "__main__":
     import argparse
@@ -202,10 +777,30 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Given the relative path of a COM directory, return the corresponding absolute path according to where the data is located.')
     parser.add_argument('-o', '--out', action='store_true', help='Return a COMOUT directory')
     parser.add_argument('-e', '--envir', metavar='envir', choices=('prod', 'para', 'test', 'canned'), help='Environment of the COM paths list to use (default: $envir environment variable if set, otherwise prod)')
+    parser.add_argument('-f', '--first', action='store_true', help='When searching the COM directories, return the first match instead of requiring exactly one')
     parser.add_argument('-v', '--verbose', action='store_true', help='Print the source of the returned COMROOT path to stderr')
-    parser.add_argument('path', metavar='relpath', help='Relative com path; must include version number starting with "v"')
+    parser.add_argument('-b', '--batch', metavar='file', nargs='?', const='-', help='Resolve every relpath listed in file (default: stdin), one per line')
+    parser.add_argument('path', metavar='relpath', nargs='?', help='Relative com path; must include version number starting with "v"')
     args = parser.parse_args()
 
+    if not path.exists('/lfs/h1'):
+        err_exit('Unable to find /lfs/h1. Are you on WCOSS?')
+
+    if args.batch:
+        if args.path:
+            parser.error('relpath cannot be combined with --batch')
+        if args.batch == '-':
+            failures = run_batch(stdin, args.envir, args.out, args.verbose, args.first)
+        else:
+            with open(args.batch, 'r') as batch_file:
+                failures = run_batch(batch_file, args.envir, args.out, args.verbose, args.first)
+        exit(1 if failures else 0)
+    if not args.path:
+        parser.error('the following arguments are required: relpath')
+
     # Parse the relative path provided as input
-    print(get_compath(args.path.strip(), args.envir, args.out, args.verbose))
+    try:
+        print(get_compath(args.path.strip(), args.envir, args.out, args.verbose, args.first))
+    except CompathError as err:
+        err_exit(str(err))
 
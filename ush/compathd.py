@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+# Purpose: Serve compath lookups over a Unix domain socket, so that shell jobs can
+#          resolve COM paths without starting a Python interpreter for each one.
+#          The server keeps the compaths.list index of every environment and the
+#          COM alias table in memory, and re-reads a list when its modification
+#          time or size changes.  The compathc client sends the same arguments
+#          as compath.py and prints the same output; it runs compath.py itself
+#          when the server is not running.
+# Usage:   compathd.py [-s socket] [-i seconds]
+#              The socket defaults to $COMPATHD_SOCKET, or /tmp/compathd.<uid>.  The
+#              server will not use a socket that belongs to another user, and the
+#              compathc client only trusts a socket and server that belong to the
+#              caller.
+# Protocol: Each request is one line of tab-separated fields:
+#              flags envir relpath COMPATH COMROOT envir_variable
+#          where flags contains "o" for a COMOUT path, "f" to accept the first match
+#          found in the COM directories and "v" for verbose output ("-" for none), envir is empty unless given with -e, and each
+#          environment variable is empty when it is unset or "=" followed by its
+#          value when it is set.  The server answers with zero or more
+#          "2<TAB>message" lines to be printed to stderr, followed by either
+#          "0<TAB>abspath" or "1<TAB>error message".
+
+from os import path, getenv, getuid
+from sys import exit, stderr
+import os, errno, signal, socket, socketserver, threading, time
+
+from compath import CompathResolver, CompathError
+
+ENVIRS = ('prod', 'para', 'test', 'canned')
+
+def default_socket():
+    return getenv('COMPATHD_SOCKET') or '/tmp/compathd.%d' % getuid()
+
+class CompathRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            fields = line.decode().rstrip('\n').split('\t')
+            if len(fields) != 6:
+                self.reply('1', 'Malformed request')
+                continue
+            flags, envir, relpath = fields[:3]
+            environ = dict()
+            for name, value in zip(('COMPATH', 'COMROOT', 'envir'), fields[3:]):
+                if value.startswith('='):
+                    environ[name] = value[1:]
+            try:
+                if envir and envir not in ENVIRS:
+                    raise CompathError('Invalid envir ' + envir)
+                # Warnings go to the client's stderr, as compath.py would print them
+                foundpath, source = self.server.resolver.resolve_with_source(
+                    relpath.strip(), envir or None, 'o' in flags, environ, 'f' in flags,
+                    warn=lambda message: self.reply('2', message))
+                if 'v' in flags:
+                    self.reply('2', source)
+                self.reply('0', foundpath)
+            except CompathError as err:
+                self.reply('1', str(err))
+
+    def reply(self, status, message):
+        self.wfile.write((status + '\t' + message + '\n').encode())
+
+class CompathServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    # Thousands of jobs may connect at once at the start of a cycle
+    request_queue_size = 1024
+
+    def __init__(self, socket_path, resolver):
+        self.resolver = resolver
+        socketserver.ThreadingUnixStreamServer.__init__(self, socket_path, CompathRequestHandler)
+
+def watch_lists(resolver, interval):
+    """!Re-reads the compaths.list of every environment whenever it changes,
+    so that requests do not wait for the list to be parsed.
+    """
+    while True:
+        time.sleep(interval)
+        resolver.preload(ENVIRS)
+
+def remove_stale_socket(socket_path):
+    # Remove a socket left behind by a server that is no longer running
+    try:
+        owner = os.lstat(socket_path).st_uid
+    except FileNotFoundError:
+        return
+    if owner != getuid():
+        print(socket_path, 'belongs to another user; set $COMPATHD_SOCKET to another path', file=stderr)
+        exit(1)
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    probe.settimeout(5)
+    try:
+        probe.connect(socket_path)
+    except OSError as err:
+        # Only a refused connection means nothing is listening; a busy server may time out
+        if err.errno == errno.ECONNREFUSED:
+            os.unlink(socket_path)
+            return
+    finally:
+        probe.close()
+    print('A compath server is already listening on', socket_path, file=stderr)
+    exit(1)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Serve compath lookups over a Unix domain socket.')
+    parser.add_argument('-s', '--socket', metavar='socket', default=default_socket(), help='Path of the socket to listen on (default: $COMPATHD_SOCKET, or /tmp/compathd.<uid>)')
+    parser.add_argument('-i', '--interval', metavar='seconds', type=float, default=5.0, help='Seconds between checks for changes to the compaths.list files (default: 5)')
+    args = parser.parse_args()
+
+    if not path.exists('/lfs/h1'):
+        print('Unable to find /lfs/h1. Are you on WCOSS?', file=stderr)
+        exit(1)
+
+    remove_stale_socket(args.socket)
+
+    resolver = CompathResolver(check_interval=args.interval)
+    resolver.preload(ENVIRS)
+    watcher = threading.Thread(target=watch_lists, args=(resolver, args.interval), daemon=True)
+    watcher.start()
+
+    server = CompathServer(args.socket, resolver)
+    signal.signal(signal.SIGTERM, lambda signum, frame: exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+# Purpose: Copy many files to their destinations the way cpfs copies one: each file is
+#          copied to <destination>.cptmp, synced to disk and then renamed, so that no
+#          partial file is ever visible under its final name.  The copies are made by a
+#          pool of workers with copy_file_range, or sendfile, or read and write where
+#          the file systems support neither; the temporary files are synced in parallel,
+#          renamed together, and each destination directory is synced once.
+# Usage:   cpfs.py [-j jobs] [-v] source destination [source destination ...]
+#          cpfs.py [-j jobs] [-v] -t directory source [source ...]
+#          cpfs.py [-j jobs] [-v] [-t directory] -l list_file
+#              The list file (- for stdin) has one "source destination" pair, or one
+#              source when -t is given, per line.  As with cpfs, a destination of "."
+#              or an existing directory means a file of the same name in it.
+#          cpfs --bulk passes its other arguments to cpfs.py.
+# Errors:  Every file that could not be copied is reported, and err_exit is then run
+#          once for all of them.  Files that were copied are still put in place.
+# Trace:   When $PRODUTIL_TRACE is set, the time taken by each bulk copy, its number of
+#          files and failures, and the copy methods used are written to the job's trace
+#          file (see prodtrace.py).
+
+from os import path, getenv
+from sys import exit, stderr
+import os, errno, stat, subprocess, sys, threading
+from concurrent.futures import ThreadPoolExecutor
+from prodtrace import trace
+
+CHUNK_SIZE = 1 << 24
+BUFFER_SIZE = 1 << 20
+TMP_SUFFIX = '.cptmp'
+
+# Errors from copy_file_range and sendfile that mean the file systems do not support them
+UNSUPPORTED = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EPERM)
+
+# Function that returns the destination file for a source, as cpfs does
+def destination_file(source, destination):
+    if destination in ('.', './'):
+        return path.join(os.getcwd(), path.basename(source))
+    elif path.isdir(destination):
+        return path.join(destination.rstrip('/') or '/', path.basename(source))
+    return destination
+
+_unsupported = set()
+_unsupported_lock = threading.Lock()
+
+def copy_data(source_fd, destination_fd):
+    """!Copies the rest of one open file to another, with the fastest method the
+    file systems support.
+
+    @returns The method used: 'copy_file_range', 'sendfile' or 'buffered'.
+    """
+    # Some file systems (e.g. /proc) make the fast methods return 0 without an error
+    # before the end of the file, so they are trusted only to copy a regular file of
+    # known size in full; the buffered copy picks up wherever they stopped
+    status = os.fstat(source_fd)
+    remaining = status.st_size - os.lseek(source_fd, 0, os.SEEK_CUR) if stat.S_ISREG(status.st_mode) else 0
+    for method in ('copy_file_range', 'sendfile'):
+        if method in _unsupported or not hasattr(os, method):
+            continue
+        copied = 0
+        try:
+            while True:
+                if method == 'copy_file_range':
+                    count = os.copy_file_range(source_fd, destination_fd, CHUNK_SIZE)
+                else:
+                    count = os.sendfile(destination_fd, source_fd, None, CHUNK_SIZE)
+                if count == 0:
+                    break
+                copied += count
+        except OSError as err:
+            # Fall back only if nothing was written, so that no data is copied twice
+            if err.errno not in UNSUPPORTED or copied:
+                raise
+            with _unsupported_lock:
+                _unsupported.add(method)
+            continue
+        if copied >= remaining > 0:
+            return method
+        break
+    while True:
+        data = os.read(source_fd, BUFFER_SIZE)
+        if not data:
+            return 'buffered'
+        view = memoryview(data)
+        while view:
+            view = view[os.write(destination_fd, view):]
+
+def copy_to_tmp(source, destination):
+    """!Copies a file to the temporary file of its destination and syncs it.
+
+    @returns The copy method used, and a warning if the sync failed.
+    """
+    tmp_file = destination + TMP_SUFFIX
+    source_fd = os.open(source, os.O_RDONLY)
+    try:
+        mode = os.fstat(source_fd).st_mode & 0o7777
+        destination_fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        try:
+            method = copy_data(source_fd, destination_fd)
+            try:
+                os.fsync(destination_fd)
+                warning = None
+            except OSError as err:
+                warning = "WARNING: fsync of " + tmp_file + " failed: " + err.strerror
+        finally:
+            os.close(destination_fd)
+    except:
+        if path.lexists(tmp_file):
+            os.unlink(tmp_file)
+        raise
+    finally:
+        os.close(source_fd)
+    return method, warning
+
+def bulk_copy(pairs, jobs=8, verbose=False):
+    """!Copies files to their destinations without ever exposing a partial file.
+
+    @param pairs:   List of (source, destination) pairs; a destination may be
+                    a directory, as with cpfs.
+    @param jobs:    Number of files to copy at once.
+    @param verbose: Whether to print each file copied and how.
+    @returns        A list of (source, message) pairs for the files that were
+                    not copied.
+    """
+    pairs = list(pairs)
+    with trace('cpfs', 'bulk', files=len(pairs), jobs=jobs) as record:
+        failures = list()
+        copies = list()
+        seen = set()
+        for source, destination in pairs:
+            destination = destination_file(source, destination)
+            if destination in seen:
+                failures.append((source, destination + ' is the destination of more than one file'))
+            else:
+                seen.add(destination)
+                copies.append((source, destination))
+
+        # Copy and sync the temporary files in parallel
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            futures = [ (source, destination, pool.submit(copy_to_tmp, source, destination))
+                        for source, destination in copies ]
+        copied = list()
+        for source, destination, future in futures:
+            try:
+                method, warning = future.result()
+            except OSError as err:
+                failures.append((source, '%s: %s' % (err.filename or source, err.strerror)))
+                continue
+            if warning:
+                print(warning, file=stderr)
+            copied.append((source, destination, method))
+
+        # Put the complete files in place, then make the renames durable with one sync per directory
+        directories = set()
+        renamed = list()
+        for source, destination, method in copied:
+            try:
+                os.replace(destination + TMP_SUFFIX, destination)
+                directories.add(path.dirname(path.abspath(destination)))
+                renamed.append("%s -> %s (%s)" % (source, destination, method))
+            except OSError as err:
+                failures.append((source, '%s%s was not moved to %s: %s' % (destination, TMP_SUFFIX, destination, err.strerror)))
+        for directory in sorted(directories):
+            try:
+                directory_fd = os.open(directory, os.O_RDONLY)
+                try:
+                    os.fsync(directory_fd)
+                finally:
+                    os.close(directory_fd)
+            except OSError as err:
+                print("WARNING: fsync of directory", directory, "failed:", err.strerror, file=stderr)
+        if verbose and renamed:
+            print('\n'.join(renamed))
+        record.update(stage='+'.join(sorted(set(method for _, _, method in copied))) or None,
+                      failures=len(failures))
+        if failures:
+            record['error'] = '%d of %d files were not copied' % (len(failures), len(pairs))
+    return failures
+
+# Function that reads source and destination pairs, or sources, from a list file
+def read_list(list_file, target_directory=None):
+    pairs = list()
+    for line in list_file:
+        fields = line.split()
+        if not fields or fields[0].startswith('#'):
+            continue
+        if target_directory is not None and len(fields) == 1:
+            pairs.append((fields[0], target_directory))
+        elif target_directory is None and len(fields) == 2:
+            pairs.append(tuple(fields))
+        else:
+            raise ValueError('Malformed line in the file list: ' + line.strip())
+    return pairs
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Copy many files safely and in parallel, as cpfs copies one.',
+        usage='''%(prog)s [-j jobs] [-v] source destination [source destination ...]
+       %(prog)s [-j jobs] [-v] -t directory source [source ...]
+       %(prog)s [-j jobs] [-v] [-t directory] -l list_file''')
+    parser.add_argument('-j', '--jobs', type=int, default=int(getenv('CPFS_JOBS') or 8), help='number of files to copy at once (default: $CPFS_JOBS, or 8)')
+    parser.add_argument('-t', '--target-directory', metavar='directory', help='copy every source into this directory')
+    parser.add_argument('-l', '--list', metavar='list_file', help='file listing the files to copy (- for stdin)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='print each file copied')
+    parser.add_argument('files', nargs='*', metavar='file')
+    args = parser.parse_args()
+
+    try:
+        if args.list:
+            if args.files:
+                parser.error('files may not be given with --list')
+            if args.list == '-':
+                pairs = read_list(sys.stdin, args.target_directory)
+            else:
+                with open(args.list) as list_file:
+                    pairs = read_list(list_file, args.target_directory)
+        elif args.target_directory is not None:
+            pairs = [ (source, args.target_directory) for source in args.files ]
+        else:
+            if len(args.files) % 2:
+                parser.error('sources and destinations must be given in pairs')
+            pairs = list(zip(args.files[::2], args.files[1::2]))
+    except (IOError, ValueError) as err:
+        print(err, file=stderr)
+        exit(16)
+    if not pairs:
+        parser.error('no files to copy')
+
+    failures = bulk_copy(pairs, args.jobs, args.verbose)
+    for source, message in failures:
+        print("ERROR: %s is missing or was not copied successfully (%s)" % (source, message), file=stderr)
+    if failures:
+        msg = "%d of %d files were missing or were not copied successfully." % (len(failures), len(pairs))
+        try:
+            subprocess.call(['err_exit', msg])
+        except OSError:
+            print(msg, file=stderr)
+        exit(1)
@@ -9,16 +9,35 @@
 #          echo "$msg" | mail.py -s subject [-c cc-addr] [-b bcc-addr] [--html] [-v] [to-addr]
 # Input:   message_file - a text file with the body of the message
 #          to-addr - a comma-delimited list of recipient e-mail addresses
+# Spool:   If $MAILSPOOL (or --spool) names a directory, the message is written to that
+#          spool and mail.py returns at once; a background mailspool.py worker delivers
+#          it through the SMTP relay in $MAILRELAY (default: localhost:25), retrying
+#          failed deliveries and coalescing storms of similar messages into digests
+#          (see mailspool.py).  Otherwise the message is handed to mailx.
+# Job:     The output path and PBS metadata of the job ($ECF_RID) are looked up once per
+#          job, from $ECF_JOBOUT and the PBS_* variables when they are set and otherwise
+#          with a single qstat call ($QSTAT, default: qstat), and kept in a cache file
+#          ($MAIL_JOB_CONTEXT, default: $DATA/.mail_job_context.<uid>.<jobid>.json; an
+#          empty value disables the file) that later mail.py calls in the job reuse.  A
+#          lookup that did not find the output path is only reused for a minute, so that
+#          a qstat that timed out is tried again.  A cache file that belongs to another
+#          user, or that others may write to, is ignored.
+# Trace:   When $PRODUTIL_TRACE is set, the time taken to spool or send each message, and
+#          to look up the job (from the cache file, the environment or qstat), are written
+#          to the job's trace file (see prodtrace.py).
 
 from __future__ import print_function
 from os import getenv, getuid, path, environ, system
-import re, grp, pwd
+import os, re, grp, pwd, json, shlex, tempfile
 import fileinput
-from subprocess import check_output, call
+from functools import lru_cache
+from subprocess import check_output, call, run, DEVNULL, CalledProcessError
 from email.utils import formatdate
 from sys import exit, stderr
 from email.mime.text import MIMEText
 from time import sleep, time
+from mailspool import spool_message, start_worker
+from prodtrace import trace
 
 # prod jobs go to the prod database, everything else goes to the para database
 envir = getenv('envir')
@@ -27,6 +46,124 @@ model = getenv('model')
 current_user=pwd.getpwuid(getuid())[0]
 current_user_address=('nco.spa' if current_user in ("ops.para" "ops.prod") else current_user) + '@noaa.gov'
 default_recipient=(getenv('MAILTO') if getenv('MAILTO') else current_user_address)
+mail_spool = getenv('MAILSPOOL')
+
+# Function that memoizes whether a user is a member of the ops group
+@lru_cache(maxsize=None)
+def is_ops_member(user):
+    return user in grp.getgrnam("ops").gr_mem
+
+# Function that returns what the environment ecFlow and PBS give a job says about it
+def job_context_from_environment(job_id, job_environ):
+    context = dict()
+    for name, variable in (('output_path', 'ECF_JOBOUT'), ('job_id', 'PBS_JOBID'), ('job_name', 'PBS_JOBNAME'),
+                           ('queue', 'PBS_QUEUE'), ('submit_host', 'PBS_O_HOST'), ('submit_dir', 'PBS_O_WORKDIR')):
+        if job_environ.get(variable):
+            context[name] = job_environ[variable]
+    return context
+
+# Function that asks PBS about a job with one qstat call
+def job_context_from_qstat(job_id, job_environ):
+    command = shlex.split(job_environ.get('QSTAT') or 'qstat') + ['-fwx', job_id]
+    try:
+        output = check_output(command, stderr=DEVNULL, universal_newlines=True)
+    except (OSError, CalledProcessError):
+        return dict()
+    attributes = dict(line.strip().split(' = ', 1) for line in output.splitlines() if ' = ' in line)
+    context = dict()
+    if 'Output_Path' in attributes:
+        # Output_Path is host:path
+        context['output_path'] = attributes['Output_Path'].split(':', 1)[-1]
+    for name, attribute in (('job_name', 'Job_Name'), ('queue', 'queue'), ('account', 'Account_Name'),
+                            ('submit_time', 'qtime'), ('exec_host', 'exec_host')):
+        if attribute in attributes:
+            context[name] = attributes[attribute]
+    return context
+
+# Sources of job information, tried in order until the output path is known
+job_context_backends = [job_context_from_environment, job_context_from_qstat]
+
+def default_job_context_cache(job_id, job_environ=environ):
+    cache_filename = job_environ.get('MAIL_JOB_CONTEXT')
+    if cache_filename is None:
+        cache_filename = path.join(job_environ.get('DATA') or '/tmp',
+                                   '.mail_job_context.%d.%s.json' % (getuid(), re.sub(r"[^\w.\[\]-]", "_", job_id)))
+    return cache_filename
+
+_job_contexts = dict()
+
+# Seconds for which a lookup that did not find the output path is reused
+failed_lookup_expiry = 60
+
+def get_job_context(job_id, job_environ=environ, backends=None, cache_filename=None):
+    """!Returns what is known about a job, looking it up only once per job.
+
+    @param job_id:         PBS job ID (e.g. $ECF_RID).
+    @param job_environ:    Mapping of the job's environment variables.
+    @param backends:       Functions taking the job ID and environment and
+                           returning a dictionary of job information, tried in
+                           order until one gives the output path (default:
+                           job_context_backends).
+    @param cache_filename: File in which to keep the result for later calls in
+                           the job; empty for none (default: $MAIL_JOB_CONTEXT
+                           or $DATA/.mail_job_context.<uid>.<jobid>.json).
+                           A lookup that found no output path is kept for
+                           failed_lookup_expiry seconds only.
+    @returns               A dictionary which has an 'output_path' item when
+                           the job's standard output is known.
+    """
+    if job_id in _job_contexts:
+        return _job_contexts[job_id]
+    with trace('mail', 'job_context', stage='cache') as record:
+        context = lookup_job_context(job_id, job_environ, backends, cache_filename, record)
+    if 'output_path' in context:
+        _job_contexts[job_id] = context
+    return context
+
+# Function that reads a job's context from its cache file, or else looks it up and
+# caches it, noting in record where it came from
+def lookup_job_context(job_id, job_environ, backends, cache_filename, record):
+    if cache_filename is None:
+        cache_filename = default_job_context_cache(job_id, job_environ)
+    context = None
+    if cache_filename:
+        try:
+            with open(cache_filename) as cache_file:
+                # Another user could plant a false output path in a shared directory such as /tmp
+                cache_stat = os.fstat(cache_file.fileno())
+                if cache_stat.st_uid != getuid() or cache_stat.st_mode & 0o022:
+                    raise ValueError('untrusted cache file')
+                cache = json.load(cache_file)
+            if cache.get('job') == job_id and ('output_path' in cache['context'] or
+                                               time() - cache.get('time', 0) < failed_lookup_expiry):
+                context = cache['context']
+        except (IOError, ValueError, KeyError, AttributeError):
+            pass
+    if context is None:
+        context = dict()
+        record['stage'] = None
+        for backend in (job_context_backends if backends is None else backends):
+            record['stage'] = backend.__name__.replace('job_context_from_', '')
+            for name, value in backend(job_id, job_environ).items():
+                context.setdefault(name, value)
+            if 'output_path' in context:
+                break
+        # Remember failures too, so that a storm of messages does not ask qstat for each,
+        # but with the time so that they are retried once they expire
+        if cache_filename:
+            try:
+                fd, tmp_filename = tempfile.mkstemp(prefix=path.basename(cache_filename) + '.',
+                                                    dir=path.dirname(cache_filename) or '.')
+                try:
+                    with os.fdopen(fd, 'w') as cache_file:
+                        json.dump({'job': job_id, 'context': context, 'time': time()}, cache_file)
+                    os.replace(tmp_filename, cache_filename)
+                except:
+                    os.unlink(tmp_filename)
+                    raise
+            except (IOError, OSError):
+                pass
+    return context
 
 email_regex=r"[a-zA-Z][-+._%a-zA-Z0-9]*@[a-zA-Z0-9]+(?:[-.][a-zA-Z0-9]+){0,12}\.[a-zA-Z]{2,15}"
 def validate_email_address_list(raw_address):
@@ -36,7 +173,7 @@ def validate_email_address_list(raw_address):
         raise ValueError('{0} does not contain a list of valid email addresses'.format(address))
     return address
 
-def send(subject, message_body, to_address=default_recipient, cc_address=None, bcc_address=None, from_name=None, is_html=False, verbose=False):
+def send(subject, message_body, to_address=default_recipient, cc_address=None, bcc_address=None, from_name=None, is_html=False, verbose=False, spool_dir=mail_spool):
     # Generate the "from" address
     from_address = current_user_address
     # Prepend the environment to the subject if not "prod"
@@ -57,12 +194,8 @@ def send(subject, message_body, to_address=default_recipient, cc_address=None, b
     if ecFlow_task_path:
         job_info.append(("ecFlow Task", ecFlow_task_path))
     if getenv('ECF_RID'):
-        try:
-            stdout_file = check_output("qstat -fwx {0} | grep Output_Path".format(getenv('ECF_RID')), shell=True).decode().split(":")[1]
-        except:
-            stdout_file="Job ran locally"
-        finally:
-            job_info.append(("Standard Output", stdout_file))
+        stdout_file = get_job_context(getenv('ECF_RID')).get('output_path', "Job ran locally")
+        job_info.append(("Standard Output", stdout_file))
     if job_info:
         job_info_text = '<br /><hr /><table>' if is_html else "\n{0}\n".format('-'*80)
         for info in job_info:
@@ -75,6 +208,9 @@ def send(subject, message_body, to_address=default_recipient, cc_address=None, b
     else:
         job_info_text = ""
 
+    # Keep the body as given, so that repeats of a message can be recognized whatever job sent them
+    original_body = message_body
+
     # Make sure html messages are wrapped in <html></html> tags
     # TODO: Do we need to validate or encode the message body?  Make sure it isn't too long or contains characters that would mess up the query?
     if is_html:
@@ -97,7 +233,7 @@ def send(subject, message_body, to_address=default_recipient, cc_address=None, b
         "body": message_body,
         "is_html": is_html
     }
-    if current_user in grp.getgrnam("ops").gr_mem:
+    if is_ops_member(current_user):
        print(message_info)
        msg = MIMEText(message_info['body'], ('html' if message_info['is_html'] else 'plain'))
        msg['Date'] = message_info['timestamp']
@@ -105,23 +241,34 @@ def send(subject, message_body, to_address=default_recipient, cc_address=None, b
            msg['From'] = "{0} <{1}>".format(message_info['from_name'], message_info['from_address'])
        else:
            msg['From'] = message_info['from_address']
-       msg['reply_to'] = message_info['reply_to']
+       msg['Reply-To'] = message_info['reply_to']
        msg['To'] = message_info['target_address']
-       msg['Cc'] = message_info['carbon_copy_address']
+       if message_info['carbon_copy_address']:
+           msg['Cc'] = message_info['carbon_copy_address']
        msg['Subject'] = message_info['message_subject']
        all_recipients = message_info['target_address'].split(',')
        if isinstance(message_info['carbon_copy_address'], str): all_recipients.extend(message_info['carbon_copy_address'].split(','))
        if isinstance(message_info['blind_carbon_copy_address'], str): all_recipients.extend(message_info['blind_carbon_copy_address'].split(','))
        
        verbose=True
-       if msg['Cc']:  
-         errors = system('echo "%s" | mailx -s "%s" -c %s %s -r %s' %(message_info['body'],msg['Subject'],msg['Cc'],msg['To'],msg['reply_to']))
-       else:
-         errors = system('echo "%s" | mailx -s "%s" %s -r %s' %(message_info['body'],msg['Subject'],msg['To'],msg['reply_to']))
+       with trace('mail', 'deliver', stage='spool' if spool_dir else 'send', recipients=len(all_recipients)):
+           if spool_dir:
+               # Leave the delivery to the spool worker so that the job does not wait on the mail system
+               # Messages with the same recipients and subject are coalesced into digests by the worker
+               spool_message(spool_dir, message_info['from_address'], all_recipients, msg.as_string(),
+                             subject=message_subject, body=original_body, job_info=job_info, is_html=is_html)
+               start_worker(spool_dir)
+           else:
+               # Pass the body on stdin so that quotes and $ in it do not reach a shell
+               mailx_command = ['mailx', '-s', msg['Subject']]
+               if msg['Cc']:
+                   mailx_command += ['-c', msg['Cc']]
+               mailx_command += [msg['To'], '-r', msg['Reply-To']]
+               errors = run(mailx_command, input=message_info['body'].rstrip('\n') + '\n', universal_newlines=True).returncode
 
-       if errors:
-           print("Unable to deliver to one or more recipients:", errors, file=stderr)
-           exit(1)
+               if errors:
+                   print("Unable to deliver to one or more recipients:", errors, file=stderr)
+                   exit(1)
     else:
         print('The following message will NOT be sent due to insufficient permissions:')
         verbose=True
@@ -170,8 +317,11 @@ usage: %(prog)s -s subject [-c cc-addr] [-b bcc-addr] [--html] [-v] [to-addr] <
         help='comma-delimited e-mail address(es) of the intended recipient(s); if omitted, the message will be sent ' +
         'to the recipient(s) specified in the $MAILTO variable, or the current user @noaa.gov if undefined')
     parser.add_argument('--html', action='store_true', help='send the message as HyperText Markup Language (HTML)')
+    parser.add_argument('--spool', default=mail_spool, metavar='spool_dir', help='spool the message for background delivery instead of running mailx (default: $MAILSPOOL)')
     (args, message) = parser.parse_known_args()
 
     message_body = ''.join(fileinput.input(message))
-    send(args.subject, message_body, args.address, args.cc, args.bcc, args.from_name, args.html, args.verbose)
-    sleep(2)
+    send(args.subject, message_body, args.address, args.cc, args.bcc, args.from_name, args.html, args.verbose, args.spool)
+    # Give mailx time to hand the message off; a spooled message is already safe on disk
+    if not args.spool:
+        sleep(2)
@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+
+# Purpose: Spool e-mail messages from mail.py and deliver them in the background.
+#          mail.py writes each message to the new/ directory of the spool and returns
+#          immediately; a single worker per spool then sends the messages over one
+#          reused SMTP connection, retrying failures with exponential backoff.
+# Usage:   mailspool.py [-s spool_dir] [-r relay] [-w seconds] [--rate count] [--once]
+#              Deliver the messages in the spool (default: $MAILSPOOL), waiting for
+#              retries to come due, and exit when the spool is empty.  Only one
+#              worker runs per spool; others exit at once.
+# Spool:   tmp/     messages being written
+#          new/     messages waiting to be sent (or retried)
+#          cur/     messages being sent by the worker
+#          failed/  messages that could not be delivered after all attempts
+#          Each message is a JSON file holding the envelope sender, the recipients,
+#          the formatted message and the delivery attempts made so far.
+# Relay:   $MAILRELAY, as host or host:port (default: localhost:25)
+# Storms:  Messages to the same recipients whose subjects match once the job IDs, dates
+#          and other numbers are ignored are coalesced: the first is sent at once, and
+#          those that follow within $MAILSPOOL_WINDOW seconds (default: 120; 0 turns
+#          coalescing off) are held and sent as one digest listing the ecFlow task and
+#          output of each.  Repeats of a message already sent in the window are dropped,
+#          and each recipient gets at most $MAILSPOOL_RATE messages an hour (default: 30;
+#          0 for no limit), later ones being held and merged.  The state needed for this
+#          is kept in state.db in the spool.
+
+from os import path, getenv, getpid
+from sys import stderr
+import os, re, fcntl, hashlib, json, smtplib, socket, sqlite3, subprocess, sys, time
+from email import message_from_string
+from email.mime.text import MIMEText
+from email.utils import formatdate
+
+SPOOL_DIRS = ('tmp', 'new', 'cur', 'failed')
+
+def default_relay():
+    return getenv('MAILRELAY') or 'localhost'
+
+def default_window():
+    return float(getenv('MAILSPOOL_WINDOW') or 120)
+
+def default_rate():
+    return int(getenv('MAILSPOOL_RATE') or 30)
+
+# Function that reduces a subject to the part shared by all the messages of an alert storm
+def normalize_subject(subject):
+    subject = re.sub(r"\d+", "#", subject.lower())
+    return re.sub(r"\s+", " ", subject).strip()
+
+def coalesce_keys(recipients, subject, body, job_info):
+    """!Returns the key shared by the messages that may be merged into one
+    digest, and the key identifying repeats of the same message.
+
+    @param recipients: List of envelope recipients.
+    @param subject:    Subject of the message, with the prefix added by mail.py.
+    @param body:       Body of the message, without the job information.
+    @param job_info:   List of (name, value) pairs describing the job.
+    @returns           A (coalesce_key, dedup_key) tuple.
+    """
+    coalesce_key = '\n'.join(sorted(set(recipients)) + [normalize_subject(subject)])
+    ecflow_task = dict(job_info).get('ecFlow Task', '')
+    dedup_key = '\n'.join([coalesce_key, ecflow_task, body])
+    return (hashlib.sha1(coalesce_key.encode()).hexdigest(),
+            hashlib.sha1(dedup_key.encode()).hexdigest())
+
+def init_spool(spool_dir):
+    for subdir in SPOOL_DIRS:
+        os.makedirs(path.join(spool_dir, subdir), exist_ok=True)
+
+_sequence = 0
+def unique_name():
+    """!Returns a file name that is unique across hosts and processes."""
+    global _sequence
+    _sequence += 1
+    return '%.6f.%d_%d.%s' % (time.time(), getpid(), _sequence, socket.gethostname())
+
+def write_record(spool_dir, name, record, subdir='new'):
+    # Write to tmp/ first so that the worker never sees a partial message
+    tmp_filename = path.join(spool_dir, 'tmp', name)
+    with open(tmp_filename, 'w') as record_file:
+        json.dump(record, record_file)
+        record_file.flush()
+        os.fsync(record_file.fileno())
+    os.rename(tmp_filename, path.join(spool_dir, subdir, name))
+
+def spool_message(spool_dir, from_address, recipients, message, **info):
+    """!Atomically adds a message to the spool and returns its name.
+
+    @param spool_dir:    Spool directory.
+    @param from_address: Envelope sender.
+    @param recipients:   List of envelope recipients, including Cc and Bcc.
+    @param message:      The formatted message, with headers.
+    @param info:         Further items to store with the message.  Messages
+                         given a subject (and the body and job_info they
+                         were built from) may be coalesced into digests.
+    @returns             The name of the message in the spool.
+    """
+    init_spool(spool_dir)
+    name = unique_name()
+    record = dict(info, from_address=from_address, recipients=recipients, message=message,
+                  queued=time.time(), attempts=0, next_attempt=0)
+    if 'subject' in info:
+        record['coalesce_key'], record['dedup_key'] = coalesce_keys(
+            recipients, info['subject'], info.get('body', ''), info.get('job_info', []))
+    write_record(spool_dir, name, record)
+    return name
+
+def start_worker(spool_dir, relay=None):
+    """!Starts a detached worker to deliver the spool, unless one is already
+    running.  The worker's output is appended to worker.log in the spool.
+    """
+    if worker_running(spool_dir):
+        return
+    command = [sys.executable, path.abspath(__file__), '-s', spool_dir]
+    if relay:
+        command += ['-r', relay]
+    with open(path.join(spool_dir, 'worker.log'), 'a') as log:
+        subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                         start_new_session=True, close_fds=True)
+
+def worker_running(spool_dir):
+    try:
+        with open(path.join(spool_dir, 'worker.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        return True
+    return False
+
+class SpoolState(object):
+    """!Small SQLite store of what a spool worker has sent recently: when
+    the coalescing window of each key opened, the dedup keys of the messages
+    sent, and the messages sent to each recipient.
+    """
+
+    def __init__(self, filename):
+        self.db = sqlite3.connect(filename)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS windows (key TEXT PRIMARY KEY, opened REAL);
+            CREATE TABLE IF NOT EXISTS seen (key TEXT PRIMARY KEY, sent REAL);
+            CREATE TABLE IF NOT EXISTS sent (recipient TEXT, sent REAL);
+            CREATE INDEX IF NOT EXISTS sent_recipient ON sent (recipient, sent);
+        """)
+
+    def window_opened(self, key):
+        row = self.db.execute('SELECT opened FROM windows WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def seen(self, key, since):
+        row = self.db.execute('SELECT sent FROM seen WHERE key = ?', (key,)).fetchone()
+        return row is not None and row[0] >= since
+
+    def rate_limited_until(self, recipients, limit, period, now):
+        """!Returns when every recipient may be sent another message, or None
+        if they all may be sent one now.
+        """
+        until = None
+        for recipient in recipients:
+            rows = self.db.execute('SELECT sent FROM sent WHERE recipient = ? AND sent > ? ORDER BY sent DESC LIMIT ?',
+                                   (recipient, now - period, limit)).fetchall()
+            if len(rows) >= limit:
+                until = max(until or 0, rows[-1][0] + period)
+        return until
+
+    def record(self, coalesce_key, dedup_keys, recipients, now):
+        with self.db:
+            if coalesce_key:
+                self.db.execute('INSERT OR REPLACE INTO windows VALUES (?, ?)', (coalesce_key, now))
+            self.db.executemany('INSERT OR REPLACE INTO seen VALUES (?, ?)', [ (key, now) for key in dedup_keys ])
+            self.db.executemany('INSERT INTO sent VALUES (?, ?)', [ (recipient, now) for recipient in recipients ])
+
+    def prune(self, before):
+        with self.db:
+            self.db.execute('DELETE FROM windows WHERE opened < ?', (before,))
+            self.db.execute('DELETE FROM seen WHERE sent < ?', (before,))
+            self.db.execute('DELETE FROM sent WHERE sent < ?', (before,))
+
+    def close(self):
+        self.db.close()
+
+# Function that merges the records of several messages into one digest message
+def make_digest(records):
+    first = records[0]
+    headers = message_from_string(first['message'])
+    lines = ['%d messages like the one below were queued between %s and %s:' %
+             (len(records), formatdate(records[0]['queued'], localtime=True), formatdate(records[-1]['queued'], localtime=True)), '']
+    for record in records:
+        lines.append('%s  %s' % (formatdate(record['queued'], localtime=True), record.get('subject', '')))
+        for name, value in record.get('job_info', []):
+            lines.append('    %s: %s' % (name, value.strip()))
+    body = first.get('body', '')
+    if first.get('is_html'):
+        body = re.sub(r"<[^>]*>", "", body)
+    lines += ['', '-'*80, body]
+    msg = MIMEText('\n'.join(lines), 'plain')
+    msg['Date'] = formatdate()
+    for header in ('From', 'Reply-To', 'To', 'Cc'):
+        if headers[header]:
+            msg[header] = headers[header]
+    msg['Subject'] = '%s [%d messages]' % (headers['Subject'] or first.get('subject', ''), len(records))
+    return msg.as_string()
+
+class SpoolWorker(object):
+    """!Delivers the messages in a spool over a single SMTP connection.
+
+    @param spool_dir:    Spool directory.
+    @param relay:        SMTP relay, as host or host:port.
+    @param max_attempts: Number of delivery attempts before a message is
+                         moved to failed/.
+    @param retry_delay:  Seconds before the first retry; the delay doubles
+                         with every attempt, up to max_delay.
+    @param max_delay:    Longest delay between attempts, in seconds.
+    @param timeout:      Timeout of SMTP operations, in seconds.
+    @param window:       Seconds during which messages like one just sent
+                         are held for a digest (default: $MAILSPOOL_WINDOW).
+    @param rate_limit:   Messages each recipient may be sent per rate_period
+                         (default: $MAILSPOOL_RATE).
+    @param rate_period:  Period of the rate limit, in seconds.
+    """
+
+    def __init__(self, spool_dir, relay=None, max_attempts=8, retry_delay=30, max_delay=3600, timeout=30,
+                 window=None, rate_limit=None, rate_period=3600):
+        self.spool_dir = spool_dir
+        self.window = default_window() if window is None else window
+        self.rate_limit = default_rate() if rate_limit is None else rate_limit
+        self.rate_period = rate_period
+        self._state = None
+        host, _, port = (relay or default_relay()).partition(':')
+        self.relay = (host, int(port or 25))
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self._smtp = None
+        self._lock = None
+        self._records = dict()
+
+    def lock(self):
+        """!Returns whether this worker is the only one running for the spool."""
+        init_spool(self.spool_dir)
+        self._lock = open(path.join(self.spool_dir, 'worker.lock'), 'a')
+        try:
+            fcntl.flock(self._lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            self._lock.close()
+            self._lock = None
+            return False
+        # Anything left in cur/ belongs to a worker that died while sending
+        for name in os.listdir(path.join(self.spool_dir, 'cur')):
+            os.rename(path.join(self.spool_dir, 'cur', name), path.join(self.spool_dir, 'new', name))
+        self._state = SpoolState(path.join(self.spool_dir, 'state.db'))
+        self._state.prune(time.time() - max(self.window, self.rate_period))
+        return True
+
+    def unlock(self):
+        """!Lets another worker take over the spool, and returns whether
+        messages arrived in new/ while this one still held the lock.  Those
+        started no worker of their own, so the caller should lock and drain
+        again.
+        """
+        if self._state is not None:
+            self._state.close()
+            self._state = None
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+        return bool(os.listdir(path.join(self.spool_dir, 'new')))
+
+    def pending(self):
+        """!Returns the waiting messages, keyed on their names, in the order
+        they were spooled.  Messages are kept in memory once read, so that
+        only those new to new/ are read from the spool.
+        """
+        records = dict()
+        new_dir = path.join(self.spool_dir, 'new')
+        for name in sorted(os.listdir(new_dir)):
+            record = self._records.get(name)
+            if record is None:
+                try:
+                    with open(path.join(new_dir, name)) as record_file:
+                        record = json.load(record_file)
+                except (IOError, ValueError):
+                    continue
+            records[name] = record
+        self._records = records
+        return dict(records)
+
+    def hold(self, names, records, until):
+        # Put messages back in new/ to be looked at again once until has passed
+        for name, record in zip(names, records):
+            record['next_attempt'] = until
+            write_record(self.spool_dir, name, record)
+            self._records[name] = record
+
+    def claim(self, name):
+        """!Moves a message from new/ to cur/ and returns it, or None if it is gone."""
+        cur_filename = path.join(self.spool_dir, 'cur', name)
+        record = self._records.pop(name, None)
+        try:
+            os.rename(path.join(self.spool_dir, 'new', name), cur_filename)
+            if record is None:
+                with open(cur_filename) as record_file:
+                    record = json.load(record_file)
+            return record
+        except (IOError, OSError, ValueError):
+            return None
+
+    def connection(self):
+        if self._smtp is None:
+            self._smtp = smtplib.SMTP(self.relay[0], self.relay[1], timeout=self.timeout)
+        return self._smtp
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self._smtp = None
+
+    def send(self, record):
+        """!Sends one message, reconnecting once if the relay closed the
+        connection.  Returns the recipients that were refused.
+        """
+        for attempt in (1, 2):
+            try:
+                return self.connection().sendmail(record['from_address'], record['recipients'],
+                                                  record['message'].encode())
+            except smtplib.SMTPServerDisconnected:
+                self._smtp = None
+                if attempt == 2:
+                    raise
+
+    def deliver(self, names, records):
+        """!Sends a group of messages that may be coalesced: drops repeats of
+        messages already sent, holds the group while its coalescing window is
+        open or a recipient is over the rate limit, and otherwise sends the
+        messages as one digest (or alone, if there is only one).
+        """
+        now = time.time()
+        state = self._state
+        coalesce_key = records[0].get('coalesce_key')
+        if coalesce_key and self.window > 0:
+            # Drop messages that repeat one sent in the window, or another in the group
+            unique = dict()
+            for name, record in zip(names, records):
+                dedup_key = record.get('dedup_key')
+                if dedup_key in unique or state.seen(dedup_key, now - self.window):
+                    print("Dropping", name, "which repeats a message already sent", file=stderr)
+                    os.unlink(path.join(self.spool_dir, 'cur', name))
+                else:
+                    unique[dedup_key] = (name, record)
+            if not unique:
+                return
+            names, records = [ list(items) for items in zip(*unique.values()) ]
+            opened = state.window_opened(coalesce_key)
+            if opened is not None and now < opened + self.window:
+                self.hold(names, records, opened + self.window)
+                self.release(names)
+                return
+        if self.rate_limit > 0:
+            until = state.rate_limited_until(records[0]['recipients'], self.rate_limit, self.rate_period, now)
+            if until is not None:
+                self.hold(names, records, until)
+                self.release(names)
+                return
+
+        message = records[0]['message'] if len(records) == 1 else make_digest(records)
+        try:
+            refused = self.send(dict(records[0], message=message))
+            if refused:
+                print("Unable to deliver", names[0], "to:", ', '.join(refused), file=stderr)
+            state.record(coalesce_key, [ record.get('dedup_key') for record in records if record.get('dedup_key') ],
+                         records[0]['recipients'], time.time())
+            for name in names:
+                os.unlink(path.join(self.spool_dir, 'cur', name))
+            return
+        except smtplib.SMTPResponseException as err:
+            permanent = err.smtp_code >= 500
+            error = "%d %s" % (err.smtp_code, err.smtp_error)
+            self.close()
+        except (smtplib.SMTPException, OSError) as err:
+            permanent = isinstance(err, smtplib.SMTPRecipientsRefused)
+            error = str(err)
+            self.close()
+        for name, record in zip(names, records):
+            record['attempts'] = record.get('attempts', 0) + 1
+            record['error'] = error
+            if permanent or record['attempts'] >= self.max_attempts:
+                print("Giving up on", name, "after", record['attempts'], "attempt(s):", error, file=stderr)
+                write_record(self.spool_dir, name, record, 'failed')
+            else:
+                delay = min(self.retry_delay * 2 ** (record['attempts'] - 1), self.max_delay)
+                record['next_attempt'] = time.time() + delay
+                print("Delivery of", name, "failed (" + error + "); retrying in", delay, "seconds", file=stderr)
+                write_record(self.spool_dir, name, record)
+                self._records[name] = record
+        self.release(names)
+
+    def release(self, names):
+        # Removes the copies in cur/ of messages that were put back in new/ or moved to failed/
+        for name in names:
+            os.unlink(path.join(self.spool_dir, 'cur', name))
+
+    def drain(self, once=False, linger=5):
+        """!Delivers every message that is due.  Unless once is set, waits for
+        retries and held digests to come due and for new messages to arrive,
+        and returns after the spool has been empty for linger seconds.
+        """
+        idle_since = time.time()
+        try:
+            while True:
+                now = time.time()
+                groups = dict()
+                for name, record in self.pending().items():
+                    if record.get('next_attempt', 0) <= now:
+                        # Without a window every message is sent on its own
+                        key = record.get('coalesce_key') if self.window > 0 else None
+                        groups.setdefault(key or name, list()).append(name)
+                for group in groups.values():
+                    claimed = [ (name, self.claim(name)) for name in group ]
+                    claimed = [ (name, record) for name, record in claimed if record is not None ]
+                    if claimed:
+                        self.deliver(*[ list(items) for items in zip(*claimed) ])
+                if once:
+                    return
+                # Messages that arrived since new/ was listed are seen on the next pass
+                due = [ record.get('next_attempt', 0) for record in self._records.values() ]
+                if due:
+                    idle_since = time.time()
+                    # Do not hold the connection open while waiting for retries
+                    if min(due) > time.time():
+                        self.close()
+                    time.sleep(max(0.1, min(1.0, min(due) - time.time())))
+                elif time.time() - idle_since >= linger:
+                    return
+                else:
+                    time.sleep(0.2)
+        finally:
+            self.close()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Deliver the e-mail messages spooled by mail.py.')
+    parser.add_argument('-s', '--spool', metavar='spool_dir', default=getenv('MAILSPOOL'), help='spool directory (default: $MAILSPOOL)')
+    parser.add_argument('-r', '--relay', metavar='host[:port]', default=default_relay(), help='SMTP relay (default: $MAILRELAY, or localhost)')
+    parser.add_argument('-w', '--window', metavar='seconds', type=float, default=default_window(), help='seconds during which similar messages are coalesced into a digest (default: $MAILSPOOL_WINDOW, or 120)')
+    parser.add_argument('--rate', metavar='count', type=int, default=default_rate(), help='messages each recipient may be sent per hour (default: $MAILSPOOL_RATE, or 30)')
+    parser.add_argument('--once', action='store_true', help='deliver the messages that are due and exit')
+    args = parser.parse_args()
+    if not args.spool:
+        parser.error('no spool directory given and $MAILSPOOL is not set')
+
+    worker = SpoolWorker(args.spool, args.relay, window=args.window, rate_limit=args.rate)
+    while worker.lock():
+        worker.drain(args.once)
+        if not worker.unlock() or args.once:
+            break
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+# Purpose: Collect postmsg lines from the jobs on a host and append them to their log
+#          files in groups, so that hundreds of writers cause one open and one write per
+#          log file per group instead of one of each per line, and lines never interleave.
+#          After the first line of a group arrives, the collector waits up to the commit
+#          delay for more (group commit), then appends all the lines for each log file
+#          with a single write, in the order they arrived.
+# Usage:   postmsgd.py [-s socket] [-d seconds] [-n lines]
+#              The socket defaults to $POSTMSGD_SOCKET, or /tmp/postmsgd.<uid>.
+#          postmsg sends its lines here through the postmsgc client when it is installed,
+#          and appends them to the log file itself when no collector is running.
+# Protocol: Each line is one datagram: the absolute path of the log file, a NUL
+#          character, and the line, ending with a newline.  postmsgc sends lines only to
+#          a socket owned by the caller, and appends lines too long for one datagram
+#          (MAX_DATAGRAM) itself; a longer datagram from another sender is cut short,
+#          and reported.
+# Errors:  Lines that cannot be appended to their log file are printed to stderr with
+#          the reason, so they are kept in the collector's own output.
+
+from os import getenv, getuid
+from sys import exit, stderr
+import os, errno, select, signal, socket, time
+from collections import OrderedDict
+
+MAX_DATAGRAM = 1 << 16
+RECEIVE_BUFFER = 1 << 22
+
+def default_socket():
+    return getenv('POSTMSGD_SOCKET') or '/tmp/postmsgd.%d' % getuid()
+
+# Function that returns the log file and line of a datagram, or None if it is malformed
+def parse_datagram(datagram):
+    logfile, separator, line = datagram.partition(b'\0')
+    if not separator or not logfile.startswith(b'/') or not line:
+        return None
+    return logfile, line if line.endswith(b'\n') else line + b'\n'
+
+def append_lines(logfile, lines):
+    """!Appends lines to a log file with a single write.
+
+    @param logfile: Path of the log file, as bytes.
+    @param lines:   Lines to append, each ending with a newline.
+    @returns        None on success, or the reason the lines were not written.
+    """
+    data = memoryview(b''.join(lines))
+    try:
+        fd = os.open(logfile, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+    except OSError as err:
+        return err.strerror
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+    except OSError as err:
+        return err.strerror
+    finally:
+        os.close(fd)
+    return None
+
+def commit(datagrams):
+    """!Appends the lines of a group of datagrams to their log files.
+
+    @returns The number of lines that could not be written.
+    """
+    by_logfile = OrderedDict()
+    for datagram in datagrams:
+        parsed = parse_datagram(datagram)
+        if parsed is None:
+            print("WARNING: Ignoring a malformed message:", repr(datagram[:80]), file=stderr)
+            continue
+        by_logfile.setdefault(parsed[0], list()).append(parsed[1])
+    failures = 0
+    for logfile, lines in by_logfile.items():
+        reason = append_lines(logfile, lines)
+        if reason:
+            failures += len(lines)
+            print("WARNING: Could not append to %s (%s):" % (logfile.decode(errors='replace'), reason), file=stderr)
+            stderr.write(b''.join(lines).decode(errors='replace'))
+            stderr.flush()
+    return failures
+
+class Collector(object):
+    """!Receives postmsg lines on a Unix datagram socket and commits them
+    in groups.
+
+    @param socket_path:  Path of the socket to listen on.
+    @param delay:        Seconds to wait for more lines after the first line
+                         of a group.
+    @param max_lines:    Most lines to commit in one group.
+    """
+
+    def __init__(self, socket_path, delay=0.05, max_lines=4096):
+        self.socket_path = socket_path
+        self.delay = delay
+        self.max_lines = max_lines
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+        except OSError:
+            pass
+        # Only the owner may send lines, since the collector writes to any file it may
+        old_umask = os.umask(0o077)
+        try:
+            self.sock.bind(socket_path)
+        finally:
+            os.umask(old_umask)
+        self.sock.setblocking(False)
+        self.buffer = bytearray(MAX_DATAGRAM)
+        self.stopping = False
+
+    def receive(self):
+        """!Returns the next datagram, reporting one that was cut short."""
+        size = self.sock.recv_into(self.buffer, 0, socket.MSG_TRUNC)
+        datagram = bytes(self.buffer[:size])
+        if size > MAX_DATAGRAM:
+            print("WARNING: A line of %d bytes was cut to %d:" % (size, MAX_DATAGRAM), repr(datagram[:80]), file=stderr)
+        return datagram
+
+    def receive_group(self, timeout=None):
+        """!Waits for a line, then gathers the lines that arrive within the
+        commit delay, and returns them.
+        """
+        datagrams = list()
+        deadline = None
+        while len(datagrams) < self.max_lines:
+            try:
+                datagrams.append(self.receive())
+                if deadline is None:
+                    deadline = time.monotonic() + self.delay
+                continue
+            except (BlockingIOError, InterruptedError):
+                pass
+            if self.stopping:
+                break
+            wait = timeout if deadline is None else deadline - time.monotonic()
+            if wait is not None and wait <= 0:
+                break
+            try:
+                ready = select.select([self.sock], [], [], wait)[0]
+            except InterruptedError:
+                continue
+            if not ready and (deadline is not None or timeout is not None):
+                break
+        return datagrams
+
+    def serve(self):
+        """!Commits groups of lines until stop() is called, then commits the
+        lines still queued.
+        """
+        while not self.stopping:
+            datagrams = self.receive_group(timeout=1.0)
+            if datagrams:
+                commit(datagrams)
+        # New lines go straight to their log files from here on
+        self.unlink()
+        datagrams = self.receive_group(timeout=0)
+        while datagrams:
+            commit(datagrams)
+            datagrams = self.receive_group(timeout=0)
+
+    def stop(self):
+        self.stopping = True
+
+    def unlink(self):
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+    def close(self):
+        self.sock.close()
+        self.unlink()
+
+def remove_stale_socket(socket_path):
+    # Remove a socket left behind by a collector that is no longer running
+    try:
+        owner = os.lstat(socket_path).st_uid
+    except FileNotFoundError:
+        return
+    if owner != getuid():
+        print(socket_path, 'belongs to another user; set $POSTMSGD_SOCKET to another path', file=stderr)
+        exit(1)
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        probe.connect(socket_path)
+    except OSError as err:
+        if err.errno != errno.ECONNREFUSED:
+            raise
+        os.unlink(socket_path)
+    else:
+        print('A postmsg collector is already listening on', socket_path, file=stderr)
+        exit(1)
+    finally:
+        probe.close()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Collect postmsg lines and append them to their log files in groups.')
+    parser.add_argument('-s', '--socket', metavar='socket', default=default_socket(), help='Path of the socket to listen on (default: $POSTMSGD_SOCKET, or /tmp/postmsgd.<uid>)')
+    parser.add_argument('-d', '--delay', metavar='seconds', type=float, default=0.05, help='Seconds to wait for more lines after the first line of a group (default: 0.05)')
+    parser.add_argument('-n', '--max-lines', metavar='lines', type=int, default=4096, help='Most lines to append in one group (default: 4096)')
+    args = parser.parse_args()
+
+    remove_stale_socket(args.socket)
+    collector = Collector(args.socket, args.delay, args.max_lines)
+    signal.signal(signal.SIGTERM, lambda signum, frame: collector.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: collector.stop())
+    try:
+        collector.serve()
+    finally:
+        collector.close()
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+
+# Purpose: Compute production dates with calendar arithmetic in a single process,
+#          instead of running date once for every day of a sequence.
+# Usage:   proddate.py finddate YYYYMMDD s+N|s-N|d+N|d-N
+#              Print the N days after or before YYYYMMDD (s), or the Nth day after or
+#              before it (d), exactly as finddate.sh does.
+#          proddate.py setpdy PDY [num_before [num_after]]
+#              Write the PDY file of setpdy.sh to the current directory, exporting
+#              PDYm<num_before>, ..., PDYm1, PDY, PDYp1, ..., PDYp<num_after>
+#              (default: 7 days before and after).
+#          proddate.py ndate [fhour [idate]]
+#          proddate.py nhour vdate [idate]
+#          proddate.py mdate [minutes [idate]]
+#              Print the same results, with the same error messages and exit status,
+#              as the ndate, nhour and mdate programs.  Dates are YYYYMMDDHH
+#              (YYYYMMDDHHMM for mdate) and default to the current UTC time.
+#          proddate.py ndate --range start stop step [idate]
+#          proddate.py mdate --range start stop step [idate]
+#              Print the date for every forecast hour (or minute) from start to stop,
+#              inclusive, one per line, e.g. "proddate.py ndate --range 0 384 3 2026101800".
+#          proddate.py ndate|nhour|mdate --batch
+#              Read the arguments of one call from each line of stdin and print one
+#              result per line; a line that is not valid gives an empty line and
+#              its error message on stderr, and makes the exit status 1.
+# Output:  Error messages are printed where the replaced programs print them: to stdout
+#          for finddate and to stderr for the others.  The exit status is 1 when the
+#          arguments are not valid (2 for the wrong number of ndate, nhour or mdate
+#          arguments).
+# Trace:   When $PRODUTIL_TRACE is set, the time taken by each call is written to the
+#          job's trace file (see prodtrace.py).
+
+from os import path
+from sys import exit, stderr
+import os, re, stat, subprocess, sys, time
+from datetime import date
+from prodtrace import trace
+
+class ProddateError(Exception):
+    pass
+
+def parse_pdy(pdy):
+    """!Returns the date of a YYYYMMDD string.
+
+    Other forms understood by "date -d" are passed to date itself, so that
+    finddate.sh accepts the same dates, and reports invalid dates with the
+    same message, as before.
+
+    @param pdy: The date string.
+    @returns    A datetime.date.
+    @raises ProddateError if the string is not a valid date.
+    """
+    if re.match(r"[0-9]{8}$", pdy):
+        try:
+            return date(int(pdy[:4]), int(pdy[4:6]), int(pdy[6:]))
+        except ValueError:
+            pass
+    output = gnu_date(pdy)
+    if not re.match(r"[0-9]{8}$", output):
+        raise ProddateError("date: invalid date '" + pdy + "'")
+    return parse_pdy(output)
+
+# Locales to which Python switches a C or POSIX LC_CTYPE at startup (PEP 538)
+COERCED_LOCALES = ('C.UTF-8', 'C.utf8', 'UTF-8')
+
+def date_environ(environ=os.environ):
+    """!Returns the environment in which to run date: the caller's, without
+    the LC_CTYPE that Python exports when it coerces a C or POSIX locale, so
+    that date quotes its messages as it does when run from the shell.
+    """
+    environ = dict(environ)
+    if (not environ.get('LC_ALL') and environ.get('LC_CTYPE') in COERCED_LOCALES and
+            environ.get('LANG', '') in ('', 'C', 'POSIX')):
+        del environ['LC_CTYPE']
+    return environ
+
+# Function that returns the YYYYMMDD output of "date -d", raising ProddateError with its message
+def gnu_date(date_string):
+    try:
+        result = subprocess.run(['date', '-d', date_string, '+%Y%m%d'], stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, universal_newlines=True, env=date_environ())
+    except OSError:
+        raise ProddateError("date: invalid date '" + date_string + "'")
+    if result.returncode != 0:
+        raise ProddateError(result.stderr.strip() or "date: invalid date '" + date_string + "'")
+    return result.stdout.strip()
+
+# Function that formats a date as YYYYMMDD
+def format_pdy(day):
+    return '%04d%02d%02d' % (day.year, day.month, day.day)
+
+def offset_pdy(day, days):
+    """!Returns the YYYYMMDD date a number of days after (or, if negative,
+    before) a date.
+
+    Dates outside the years 1 to 9999 are left to "date -d", so that they
+    are printed as finddate.sh always has (e.g. 294020126).
+
+    @raises ProddateError if date cannot represent the result either.
+    """
+    try:
+        return format_pdy(date.fromordinal(day.toordinal() + days))
+    except (ValueError, OverflowError):
+        return gnu_date('%s %s%d days' % (format_pdy(day), '-' if days < 0 else '+', abs(days)))
+
+def add_days(pdy, days):
+    """!Returns the YYYYMMDD date a number of days after (or, if negative,
+    before) a YYYYMMDD date.
+    """
+    return offset_pdy(parse_pdy(pdy), days)
+
+def day_sequence(pdy, count, direction=1):
+    """!Returns the count YYYYMMDD dates following (direction=1) or preceding
+    (direction=-1) a YYYYMMDD date, nearest first.
+    """
+    day = parse_pdy(pdy)
+    return [ offset_pdy(day, direction * offset) for offset in range(1, count + 1) ]
+
+def finddate(args):
+    """!Returns the output of finddate.sh for its arguments.
+
+    @param args: The arguments of finddate.sh: YYYYMMDD and s+N, s-N, d+N or d-N.
+    @returns     The dates, separated by spaces.
+    @raises ProddateError with the message of finddate.sh if the arguments are
+            not valid.
+    """
+    if len(args) != 2:
+        raise ProddateError("Number of input must equal 2")
+    pdy, spec = args
+    sod, direction, num = spec[:1], spec[1:2], spec[2:]
+    if len(pdy) != 8:
+        raise ProddateError("Length of first input must be 8, formatted as YYYYMMDD")
+    day = parse_pdy(pdy)
+    if sod not in ('s', 'd'):
+        raise ProddateError("First argument of second input must be 's' or 'd'. You use " + sod + ".")
+    if direction not in ('+', '-'):
+        raise ProddateError("Second argument of second input must be '+' or '-'. You use " + direction + ".")
+    if not re.match(r"[0-9]+$", num):
+        raise ProddateError("Third argument of second input must be an integer. You use " + num + ".")
+    sign = 1 if direction == '+' else -1
+    if sod == 's':
+        return ' '.join(day_sequence(format_pdy(day), int(num), sign))
+    else:
+        return offset_pdy(day, sign * int(num))
+
+def write_pdy_file(pdy, dates_before_PDY=7, dates_after_PDY=7, filename='PDY'):
+    """!Writes the PDY file of setpdy.sh, which exports PDYm<dates_before_PDY>,
+    ..., PDYm1, PDY, PDYp1, ..., PDYp<dates_after_PDY>.
+    """
+    lines = [ 'export PDYm%d=%s\n' % (offset, add_days(pdy, -offset)) for offset in range(dates_before_PDY, 0, -1) ]
+    lines.append('export PDY=%s\n' % pdy)
+    lines += [ 'export PDYp%d=%s\n' % (offset, add_days(pdy, offset)) for offset in range(1, dates_after_PDY + 1) ]
+    # Replace any old file, as setpdy.sh did with rm and >>
+    if path.lexists(filename):
+        os.unlink(filename)
+    with open(filename, 'w') as pdy_file:
+        pdy_file.write(''.join(lines))
+    os.chmod(filename, os.stat(filename).st_mode | stat.S_IXUSR)
+
+# Dates are handled as whole seconds since the start of the proleptic Gregorian
+# calendar, so that adding hours or minutes to many dates is integer arithmetic.
+SECONDS_PER_DAY = 86400
+
+def parse_date(string, with_minutes=False):
+    """!Returns the seconds since 0001-01-01 of a YYYYMMDDHH date, or of a
+    YYYYMMDDHHMM date if with_minutes is set.  As in ndate, the year may have
+    any number of digits.
+
+    @raises ProddateError if the string is not a valid date.
+    """
+    match = re.match(r"([0-9]+)([0-9]{2})([0-9]{2})([0-9]{2})" + ("([0-9]{2})" if with_minutes else "()") + "$", string)
+    try:
+        year, month, day, hour, minute = [ int(field or 0) for field in match.groups() ]
+        if hour > 23 or minute > 59:
+            raise ValueError(string)
+        return (date(year, month, day).toordinal() * 24 + hour) * 3600 + minute * 60
+    except (AttributeError, ValueError):
+        raise ProddateError('Invalid date ' + string)
+
+def format_date(seconds, with_minutes=False):
+    """!Returns the YYYYMMDDHH date, or the YYYYMMDDHHMM date if with_minutes
+    is set, of a number of seconds since 0001-01-01.
+    """
+    days, seconds = divmod(seconds, SECONDS_PER_DAY)
+    try:
+        day = date.fromordinal(days)
+    except ValueError:
+        raise ProddateError('Date out of range')
+    hour, seconds = divmod(seconds, 3600)
+    if with_minutes:
+        return '%d%02d%02d%02d%02d' % (day.year, day.month, day.day, hour, seconds // 60)
+    return '%d%02d%02d%02d' % (day.year, day.month, day.day, hour)
+
+# Function that returns the current UTC time as seconds since 0001-01-01
+def utc_now():
+    return int(time.time()) + date(1970, 1, 1).toordinal() * SECONDS_PER_DAY
+
+# Function that rounds seconds to the nearest hour, halves away from zero as Fortran's NINT does
+def round_hours(seconds):
+    hours = (2 * abs(seconds) + 3600) // 7200
+    return hours if seconds >= 0 else -hours
+
+def parse_integer(string, what):
+    if not re.match(r"\s*[-+]?[0-9]+\s*$", string):
+        raise ProddateError('Noninteger ' + what + ' ' + string)
+    return int(string)
+
+def valid_dates(fhours, idate=None):
+    """!Returns the YYYYMMDDHH verifying dates of a sequence of forecast hours,
+    as ndate computes them one at a time.
+
+    @param fhours: Forecast hours (which may be negative).
+    @param idate:  Initial date, as YYYYMMDDHH (default: the current UTC time).
+    @returns       A list of YYYYMMDDHH strings.
+    """
+    start = utc_now() if idate is None else parse_date(idate)
+    return [ format_date(start + 3600 * int(fhour)) for fhour in fhours ]
+
+def forecast_hours(vdates, idates=None):
+    """!Returns the forecast hours from initial to verifying dates, rounded to
+    the nearest hour, as nhour computes them one at a time.
+
+    @param vdates: Verifying dates, as YYYYMMDDHH.
+    @param idates: Initial dates, as YYYYMMDDHH: one for every verifying date,
+                   or a single string for all of them (default: the current
+                   UTC time).
+    @returns       A list of integers.
+    """
+    if idates is None or isinstance(idates, str):
+        start = utc_now() if idates is None else parse_date(idates)
+        starts = [ start ] * len(vdates)
+    else:
+        starts = [ parse_date(idate) for idate in idates ]
+    return [ round_hours(parse_date(vdate) - start) for vdate, start in zip(vdates, starts) ]
+
+def minute_dates(minutes, idate=None):
+    """!Returns the YYYYMMDDHHMM dates a sequence of minute offsets from an
+    initial date, as mdate computes them one at a time.
+
+    @param minutes: Minute offsets (which may be negative).
+    @param idate:   Initial date, as YYYYMMDDHHMM (default: the current UTC
+                    time).
+    @returns        A list of YYYYMMDDHHMM strings.
+    """
+    start = utc_now() if idate is None else parse_date(idate, with_minutes=True)
+    return [ format_date(start + 60 * int(minute), with_minutes=True) for minute in minutes ]
+
+# Function that returns the inclusive range of integers from start to stop
+def inclusive_range(start, stop, step):
+    if step == 0:
+        raise ProddateError('Step of --range must not be zero')
+    return range(start, stop + (1 if step > 0 else -1), step)
+
+# Function that parses the options of ndate and mdate, which allow only "--" and
+# take negative numbers as arguments
+def fortran_options(args):
+    while args and args[0].startswith('-') and not args[0][1:2].isdigit():
+        if args[0] == '--':
+            return args[1:]
+        raise ProddateError('Invalid option ' + (args[0][1:2] or '-'))
+    return args
+
+# Function that runs one call of ndate, nhour or mdate and returns its output
+def run_date_program(program, args, now):
+    if program == 'nhour':
+        if not 1 <= len(args) <= 2:
+            raise ProddateError('Incorrect number of arguments', 2)
+        verifying = parse_date(args[0])
+        hour = round_hours(verifying - (parse_date(args[1]) if len(args) == 2 else now))
+        return '%s%02d' % ('-' if hour < 0 else '', abs(hour))
+    args = fortran_options(args)
+    if len(args) > 2:
+        raise ProddateError('Incorrect number of arguments', 2)
+    what = 'forecast hour' if program == 'ndate' else 'minute'
+    offset = parse_integer(args[0], what) if args else 0
+    with_minutes = program == 'mdate'
+    start = parse_date(args[1], with_minutes) if len(args) == 2 else now
+    return format_date(start + offset * (3600 if program == 'ndate' else 60), with_minutes)
+
+# Function that runs the finddate subcommand
+def finddate_main(args):
+    try:
+        print(finddate(args))
+    except ProddateError as err:
+        if str(err).startswith('date:'):
+            print(err, file=stderr)
+        else:
+            print(err)
+        return 1
+    return 0
+
+# Function that runs the setpdy subcommand
+def setpdy_main(args):
+    if not 1 <= len(args) <= 3 or not all(re.match(r"[0-9]+$", arg) for arg in args[1:]):
+        print("Usage: proddate.py setpdy PDY [num_before [num_after]]", file=stderr)
+        return 1
+    dates_before_PDY = int(args[1]) if len(args) > 1 else 7
+    dates_after_PDY = int(args[2]) if len(args) > 2 else dates_before_PDY
+    try:
+        parse_pdy(args[0])
+        write_pdy_file(args[0], dates_before_PDY, dates_after_PDY)
+    except ProddateError as err:
+        print(err, file=stderr)
+        return 1
+    return 0
+
+usages = {
+    'ndate': 'ndate [fhour [idate]]',
+    'nhour': 'nhour vdate [idate]',
+    'mdate': 'mdate [minutes [idate]]',
+}
+
+# Function that runs the ndate, nhour or mdate subcommand
+def date_program_main(program, args):
+    now = utc_now()
+    def report(err):
+        print(program + ': ' + err.args[0], file=stderr)
+        print('Usage: ' + usages[program], file=stderr)
+        return err.args[1] if len(err.args) > 1 else 1
+
+    if args[:1] == ['--batch']:
+        if len(args) > 1:
+            return report(ProddateError('Incorrect number of arguments', 2))
+        status = 0
+        output = list()
+        for line in sys.stdin:
+            try:
+                output.append(run_date_program(program, line.split(), now))
+            except ProddateError as err:
+                print(program + ': ' + err.args[0], file=stderr)
+                output.append('')
+                status = 1
+        print('\n'.join(output))
+        return status
+
+    try:
+        if args[:1] == ['--range'] and program != 'nhour':
+            if not 4 <= len(args) <= 5:
+                raise ProddateError('Incorrect number of arguments', 2)
+            what = 'forecast hour' if program == 'ndate' else 'minute'
+            offsets = inclusive_range(*[ parse_integer(arg, what) for arg in args[1:4] ])
+            idate = args[4] if len(args) == 5 else format_date(now, program == 'mdate')
+            if program == 'ndate':
+                results = valid_dates(offsets, idate)
+            else:
+                results = minute_dates(offsets, idate)
+            print('\n'.join(results))
+        else:
+            print(run_date_program(program, args, now))
+    except ProddateError as err:
+        return report(err)
+    return 0
+
+commands = {
+    'finddate': finddate_main,
+    'setpdy': setpdy_main,
+    'ndate': lambda args: date_program_main('ndate', args),
+    'nhour': lambda args: date_program_main('nhour', args),
+    'mdate': lambda args: date_program_main('mdate', args),
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        print("Usage: proddate.py {" + ','.join(commands) + "} arguments...", file=stderr)
+        exit(1)
+    args = sys.argv[2:]
+    with trace('proddate', sys.argv[1], args=args) as record:
+        record['stage'] = args[0][2:] if args[:1] in (['--batch'], ['--range']) else 'single'
+        status = commands[sys.argv[1]](args)
+        if status:
+            record['error'] = 'exit status %d' % status
+    exit(status)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+# Purpose: Optional timing of the prod_util utilities.  When $PRODUTIL_TRACE is set, each
+#          call to compath, mail.py, cpfs --bulk and proddate.py appends one JSON line to
+#          the job's trace file with the utility, the operation, the stage that answered
+#          it (e.g. COMPATH, list or probe for compath; spool or send for mail), its wall
+#          time and any error.
+# Setup:   PRODUTIL_TRACE=YES writes ${DATA:-/tmp}/prodtrace.<job>.<jobid>.jsonl, and
+#          PRODUTIL_TRACE=directory writes directory/<job>.<jobid>.jsonl, so that the
+#          traces of many jobs can be collected in one place.  <job> is $job and <jobid>
+#          is $jobid or $PBS_JOBID (the user ID for work outside of a job).
+# Usage:   prodtrace.py report [--json] [--by utility|operation|stage] trace [trace ...]
+#              aggregates trace files, or the *.jsonl files under directories, into the
+#              number of calls, errors, total time and latency percentiles of each
+#              operation, and the share of its calls answered by each stage, slowest
+#              operations first.
+# Python:  with prodtrace.trace('compath', 'resolve', relpath=relpath) as record:
+#              ...
+#              record['stage'] = 'list'
+#          Trace files are written with one O_APPEND write per record, so concurrent
+#          processes of a job may share one, and problems writing them are ignored.
+
+from os import path, environ, getuid
+from sys import exit, stderr, stdout
+import os, re, json, math, socket, time
+from collections import defaultdict
+from contextlib import contextmanager
+
+DISABLED = ('', 'NO', 'N', 'FALSE', '0')
+
+def trace_file(trace_environ=environ):
+    """!Returns the trace file of the job, or None if tracing is off.
+
+    @param trace_environ: Mapping to read $PRODUTIL_TRACE and the job's
+                          variables from (default: os.environ).
+    """
+    setting = trace_environ.get('PRODUTIL_TRACE', '')
+    if setting.upper() in DISABLED:
+        return None
+    job_id = trace_environ.get('jobid') or trace_environ.get('PBS_JOBID') or str(getuid())
+    name = re.sub(r"[^\w.-]", "_", '%s.%s' % (trace_environ.get('job') or 'nojob', job_id))
+    if setting.upper() in ('YES', 'Y', 'TRUE', '1'):
+        return path.join(trace_environ.get('DATA') or '/tmp', 'prodtrace.' + name + '.jsonl')
+    return path.join(setting, name + '.jsonl')
+
+_trace_fds = dict()
+
+def write_record(filename, record):
+    """!Appends a record to a trace file with a single write, ignoring errors."""
+    line = (json.dumps(record, separators=(',', ':'), default=str) + '\n').encode()
+    try:
+        fd = _trace_fds.get(filename)
+        if fd is None:
+            directory = path.dirname(filename)
+            if directory and not path.isdir(directory):
+                os.makedirs(directory, exist_ok=True)
+            fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            _trace_fds[filename] = fd
+        os.write(fd, line)
+    except OSError:
+        pass
+
+@contextmanager
+def trace(utility, operation, **fields):
+    """!Times the body of a with statement and appends a record of it to the
+    job's trace file, if tracing is on.  The record is a dictionary which the
+    body may add to, typically to set its 'stage'.  An exception raised by
+    the body is recorded as the 'error' and raised again.
+
+    @param utility:   Name of the utility (e.g. 'compath').
+    @param operation: Name of what the utility is doing (e.g. 'resolve').
+    @param fields:    Other items to include in the record.
+    """
+    filename = trace_file()
+    record = dict(utility=utility, operation=operation, stage=None)
+    record.update(fields)
+    if filename is None:
+        yield record
+        return
+    record['start'] = round(time.time(), 6)
+    start = time.perf_counter()
+    try:
+        yield record
+    except SystemExit as err:
+        if err.code:
+            record.setdefault('error', 'exit status %s' % err.code)
+        raise
+    except BaseException as err:
+        record['error'] = '%s: %s' % (type(err).__name__, err)
+        raise
+    finally:
+        record['seconds'] = round(time.perf_counter() - start, 6)
+        record.setdefault('error', None)
+        record.update(job=environ.get('job'), jobid=environ.get('jobid') or environ.get('PBS_JOBID'),
+                      host=socket.gethostname(), pid=os.getpid())
+        write_record(filename, record)
+
+# Function that yields the records of trace files, and of the *.jsonl files under directories
+def read_traces(paths):
+    for trace_path in paths:
+        if path.isdir(trace_path):
+            filenames = sorted(path.join(directory, name) for directory, _, names in os.walk(trace_path)
+                               for name in names if name.endswith('.jsonl'))
+        else:
+            filenames = [trace_path]
+        for filename in filenames:
+            with open(filename) as trace:
+                for line in trace:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # A record cut short, e.g. by a full disk
+                    if isinstance(record, dict) and 'seconds' in record:
+                        yield record
+
+# Function that returns the nearest-rank percentile of a sorted list
+def percentile(values, fraction):
+    return values[min(len(values), max(1, math.ceil(fraction * len(values)))) - 1]
+
+def summarize(records, by=('utility', 'operation')):
+    """!Aggregates trace records into latency percentiles and stage hit rates.
+
+    @param records: Iterable of trace records.
+    @param by:      Record items whose values define the groups.
+    @returns        A list with a dictionary for each group, the groups that
+                    took the most time first.
+    """
+    groups = defaultdict(list)
+    for record in records:
+        groups[tuple(str(record.get(item)) for item in by)].append(record)
+    summaries = list()
+    for key, group in groups.items():
+        seconds = sorted(record['seconds'] for record in group)
+        stages = defaultdict(int)
+        for record in group:
+            stages[record.get('stage') or 'none'] += 1
+        summary = dict(zip(by, key))
+        summary.update(calls=len(group),
+                       errors=sum(1 for record in group if record.get('error')),
+                       jobs=len(set((record.get('job'), record.get('jobid')) for record in group)),
+                       total_seconds=round(sum(seconds), 6),
+                       p50=percentile(seconds, 0.5), p90=percentile(seconds, 0.9),
+                       p99=percentile(seconds, 0.99), max=seconds[-1],
+                       stages=dict((stage, round(count / len(group), 4))
+                                   for stage, count in sorted(stages.items(), key=lambda item: -item[1])))
+        summaries.append(summary)
+    summaries.sort(key=lambda summary: -summary['total_seconds'])
+    return summaries
+
+# Function that prints summaries as a table, with times in milliseconds
+def print_report(summaries, by, output=stdout):
+    columns = list(by) + ['calls', 'errors', 'jobs', 'total_s', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms', 'stages']
+    rows = list()
+    for summary in summaries:
+        rows.append([ summary[item] for item in by ] +
+                    [ str(summary['calls']), str(summary['errors']), str(summary['jobs']),
+                      '%.3f' % summary['total_seconds'] ] +
+                    [ '%.2f' % (summary[item] * 1000) for item in ('p50', 'p90', 'p99', 'max') ] +
+                    [ ' '.join('%s:%.0f%%' % (stage, rate * 100) for stage, rate in summary['stages'].items()) ])
+    widths = [ max([len(column)] + [ len(row[i]) for row in rows ]) for i, column in enumerate(columns) ]
+    for row in [columns] + rows:
+        print('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip(), file=output)
+
+def report_main(args):
+    import argparse
+    parser = argparse.ArgumentParser(prog='prodtrace.py report', description='Aggregate prod_util trace files.')
+    parser.add_argument('--by', choices=('utility', 'operation', 'stage'), default='operation',
+                        help='group the calls by utility, by utility and operation (the default), or by utility, operation and stage')
+    parser.add_argument('--json', action='store_true', help='print the summaries as JSON')
+    parser.add_argument('traces', nargs='+', metavar='trace', help='trace file, or directory of trace files')
+    args = parser.parse_args(args)
+    by = {'utility': ('utility',), 'operation': ('utility', 'operation'),
+          'stage': ('utility', 'operation', 'stage')}[args.by]
+    try:
+        summaries = summarize(read_traces(args.traces), by)
+    except IOError as err:
+        print('prodtrace.py:', err, file=stderr)
+        return 1
+    if args.json:
+        print(json.dumps(summaries, indent=2))
+    else:
+        print_report(summaries, by)
+    return 0
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:2] != ['report']:
+        print("Usage: prodtrace.py report [--json] [--by utility|operation|stage] trace [trace ...]", file=stderr)
+        exit(1)
+    exit(report_main(sys.argv[2:]))
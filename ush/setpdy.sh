@@ -57,26 +57,8 @@ else
    sed "s/[0-9]\{8\}/$PDY/" ${COMDATEROOT}/date/$cycle > ncepdate
 fi
 
-# Use grep to search through date table to find production date-line
-# date-line = day minus 1, day minus 2, .. day minus $dates_before_PDY
-DATElne_minus=$(finddate.sh $PDY s-${dates_before_PDY})
+# Write the PDY script with PDYm${dates_before_PDY}, ..., PDY, ..., PDYp${dates_after_PDY}
+proddate.py setpdy $PDY ${dates_before_PDY} ${dates_after_PDY}
 export err=$?; err_chk
-# date-line = day plus 1, day plus 2, .. day plus $dates_after_PDY
-DATElne_plus=$(finddate.sh $PDY s+${dates_after_PDY})
-export err=$?; err_chk
-
-# Cut date-line to form PDY variables
-if [ -f PDY ]; then rm PDY; fi
-for d in $(seq $dates_before_PDY -1 1); do
-   # cut the date starting at position ($d-1)*9 from date-line
-   echo "export PDYm${d}=${DATElne_minus:((($d-1)*9)):8}" >>PDY
-done
-echo "export PDY=$PDY" >>PDY
-for d in $(seq $dates_after_PDY); do
-   # cut the date starting at position ($d-1)*9 from date-line
-   echo "export PDYp${d}=${DATElne_plus:((($d-1)*9)):8}" >>PDY
-done
-
-chmod u+x PDY
 
 echo "Source PDY script to export PDYm${dates_before_PDY}, ..., PDY, ..., PDYp${dates_after_PDY} variables."